@@ -2,6 +2,7 @@
 from flask import Flask
 from flask_cors import CORS
 
+from .cli import refresh_metrics_command
 from .db import create_db_interface, db
 
 
@@ -9,14 +10,39 @@ def create_app():
     return Flask(__name__)
 
 
-def configure_app(app, *blueprints, database_interface=None, **mysql_kwargs):
-    """Initialize CORS handling in app, and register blueprints.
+def configure_app(
+    app,
+    *blueprints,
+    database_interface=None,
+    replica_interfaces=None,
+    replica_hosts=None,
+    secret_key=None,
+    monitor_sql_queries=False,
+    **mysql_kwargs,
+):
+    """Initialize CORS handling in app, register blueprints and CLI commands.
     Configure the app's database interface. `mysql_kwargs` are forwarded.
+    Optionally configure read replicas, either as database interfaces, or as hosts
+    (reached via TCP with the same connection parameters as the primary database).
+    The `secret_key` is used for signing tokens that route queries of users who recently
+    performed mutations to the primary database (see `db.register_write()`).
+    If `monitor_sql_queries` is set (development mode), SQL queries of GraphQL requests
+    are monitored for slow queries and N+1 patterns (see
+    `instrumentation.QueryMonitorExtension`).
     """
     CORS(app)
+    app.secret_key = secret_key
+    app.config["MONITOR_SQL_QUERIES"] = monitor_sql_queries
 
     for blueprint in blueprints:
         app.register_blueprint(blueprint)
+    app.cli.add_command(refresh_metrics_command)
 
     app.config["DATABASE"] = database_interface or create_db_interface(**mysql_kwargs)
+    # A Unix socket would be used instead of the host, i.e. connect to the primary
+    replica_kwargs = {k: v for k, v in mysql_kwargs.items() if k != "unix_socket"}
+    app.config["DATABASE_REPLICAS"] = replica_interfaces or [
+        create_db_interface(**{**replica_kwargs, "host": host})
+        for host in replica_hosts or []
+    ]
     db.init_app(app)
@@ -0,0 +1,12 @@
+"""Alternative entry point for serving the GraphQL APIs via ASGI, e.g. by
+    uvicorn boxtribute_server.asgi:app
+The app is configured as in `main`.
+"""
+import os
+
+from .graph_ql.asgi import create_asgi_app
+from .main import app as flask_app
+
+app = create_asgi_app(
+    flask_app, expose_full_graphql=os.getenv("EXPOSE_FULL_GRAPHQL") is not None
+)
@@ -1,15 +1,28 @@
 """Utilities for handling authentication"""
+import hashlib
 import json
 import os
+import threading
+import time
 import urllib
 from functools import wraps
 
 from flask import g, request
 from jose import JOSEError, jwt
 
+from .cache import Cache
 from .exceptions import AuthenticationFailed
 
 JWT_CLAIM_PREFIX = "https://www.boxtribute.com"
+JWKS_URL = os.getenv("AUTH0_JWKS_URL", "https://{domain}/.well-known/jwks.json")
+# Time (in seconds) that fetched public keys are considered fresh, resp. that stale
+# keys are still used while being refreshed
+JWKS_CACHE_TTL = int(os.getenv("AUTH0_JWKS_CACHE_TTL", 3600))
+JWKS_CACHE_STALE_TTL = int(os.getenv("AUTH0_JWKS_CACHE_STALE_TTL", 86400))
+# Maximum number of verified tokens whose user information is cached
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 1024))
+
+token_cache = Cache(max_size=TOKEN_CACHE_SIZE)
 
 
 def get_auth_string_from_header():
@@ -56,20 +69,129 @@ def get_token_from_auth_header(header_string):
     return token
 
 
-def get_public_key(domain):
-    kid = os.getenv("AUTH0_JWKS_KID")
+class JwksCache:
+    """In-process cache of the public keys in the JSON Web Key Sets (JWKS) of Auth0
+    domains, indexed by key ID (`kid`).
+    - Keys are fetched from the JWKS endpoint when first requested, and considered
+      fresh for `ttl` seconds.
+    - A stale key set is still served for up to `stale_ttl` seconds after it went
+      stale, while a background thread refreshes it (stale-while-revalidate). If the
+      refresh fails, the stale key set remains in use. Beyond that, the key set is
+      fetched synchronously.
+    - An unknown key ID (e.g. after a key rotation) triggers a synchronous refetch, at
+      most once per `min_refetch_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        *,
+        url=JWKS_URL,
+        ttl=JWKS_CACHE_TTL,
+        stale_ttl=JWKS_CACHE_STALE_TTL,
+        min_refetch_interval=60,
+        clock=time.monotonic,
+    ):
+        self.url = url
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.min_refetch_interval = min_refetch_interval
+        self._clock = clock
+        # Mapping of domain to pair of key set (mapping of key ID to key) and time of
+        # fetching
+        self._key_sets = {}
+        self._refresh_threads = {}
+        self._lock = threading.Lock()
+
+    def _fetch(self, domain):
+        """Fetch the key set of the domain, store and return it."""
+        with urllib.request.urlopen(self.url.format(domain=domain)) as response:
+            jwks = json.loads(response.read())
+        keys = {key.get("kid"): key for key in jwks["keys"]}
+        with self._lock:
+            self._key_sets[domain] = (keys, self._clock())
+        return keys
+
+    def _refresh(self, domain):
+        try:
+            self._fetch(domain)
+        except Exception:
+            # Keep using the stale key set; retry when it's requested the next time
+            pass
+
+    def _refresh_in_background(self, domain):
+        with self._lock:
+            thread = self._refresh_threads.get(domain)
+            if thread is not None and thread.is_alive():
+                return
+            thread = threading.Thread(target=self._refresh, args=(domain,), daemon=True)
+            self._refresh_threads[domain] = thread
+        thread.start()
+
+    def get_key(self, domain, kid=None):
+        """Return the key of the domain's JWKS with the given key ID, or the first key
+        if no key ID given. Fetch or refresh the key set as described above.
+        Raise AuthenticationFailed if the key ID is unknown.
+        """
+        with self._lock:
+            keys, fetched_at = self._key_sets.get(domain, (None, None))
+
+        if keys is None:
+            keys = self._fetch(domain)
+        else:
+            age = self._clock() - fetched_at
+            if age > self.ttl + self.stale_ttl:
+                keys = self._fetch(domain)
+            elif age > self.ttl:
+                self._refresh_in_background(domain)
+            if (
+                kid is not None
+                and kid not in keys
+                and (age > self.min_refetch_interval)
+            ):
+                keys = self._fetch(domain)
+
+        if kid is None:
+            return next(iter(keys.values()))
+        try:
+            return keys[kid]
+        except KeyError:
+            raise AuthenticationFailed(
+                {
+                    "code": "invalid_header",
+                    "description": "Unable to find appropriate key.",
+                },
+                401,
+            )
+
+
+jwks_cache = JwksCache()
+
+
+def get_public_key(domain, kid=None):
+    """Return the public key with the given ID (default: the first key) of the Auth0
+    domain. Skip reaching out to the Auth0 service if the key is set in the environment.
+    """
+    kid_from_env = os.getenv("AUTH0_JWKS_KID")
     n = os.getenv("AUTH0_JWKS_N")
-    if kid and n:  # pragma: no cover
+    if kid_from_env and n:  # pragma: no cover
         return {
             "kty": "RSA",
             "e": "AQAB",
             "use": "sig",
-            "kid": kid,
+            "kid": kid_from_env,
             "n": n,
         }
-    url = urllib.request.urlopen(f"https://{domain}/.well-known/jwks.json")
-    jwks = json.loads(url.read())
-    return jwks["keys"][0]
+    return jwks_cache.get_key(domain, kid)
+
+
+def get_key_id(token):
+    """Return the ID of the key that the token was signed with, or None if it can't be
+    determined. Parsing errors are reported when decoding the token.
+    """
+    try:
+        return jwt.get_unverified_header(token).get("kid")
+    except JOSEError:
+        return
 
 
 def decode_jwt(*, token, public_key, domain, audience):
@@ -124,12 +246,18 @@ class CurrentUser:
         that the permission is granted for, or to None if the permission is granted for
         all bases. However it is never exposed directly to avoid accidental
         manipulation.
+        The base IDs are stored as frozensets for fast membership tests. Since the
+        instance is immutable, it can be cached along with the JWT it was created from
+        (see `get_current_user()`).
         The `organisation_id` field is set to None for god users.
         """
         self._id = id
         self._organisation_id = None if is_god else organisation_id
         self._is_god = is_god
-        self._base_ids = base_ids or {}
+        self._base_ids = {
+            permission: None if ids is None else frozenset(ids)
+            for permission, ids in (base_ids or {}).items()
+        }
 
     @classmethod
     def from_jwt(cls, payload):
@@ -173,10 +301,25 @@ class CurrentUser:
         return name in self._base_ids
 
     def authorized_base_ids(self, permission):
+        """Return frozenset of IDs of bases that the permission is granted for, or None
+        if it is granted for all bases.
+        """
         if self.is_god:
             return None
         return self._base_ids[permission]
 
+    def to_dict(self):
+        """Return JSON-serializable representation of the user's attributes."""
+        return {
+            "_id": self._id,
+            "_organisation_id": self._organisation_id,
+            "_is_god": self._is_god,
+            "_base_ids": {
+                permission: None if ids is None else sorted(ids)
+                for permission, ids in self._base_ids.items()
+            },
+        }
+
     @property
     def id(self):
         return self._id
@@ -190,6 +333,32 @@ class CurrentUser:
         return self._is_god
 
 
+def get_current_user(*, token, domain, audience):
+    """Decode the token (see `decode_jwt()`), and extract user information from its
+    payload.
+    Tokens are typically sent many times until they expire. If a token carries an
+    expiration time, the resulting user information is cached until then (keyed by the
+    token's hash, and the domain and audience the token was verified for), and
+    repeated verification is skipped.
+    """
+    key = (hashlib.sha256(token.encode()).hexdigest(), domain, audience)
+    user = token_cache.get(key)
+    if user is not None:
+        return user
+
+    payload = decode_jwt(
+        token=token,
+        public_key=get_public_key(domain, get_key_id(token)),
+        domain=domain,
+        audience=audience,
+    )
+    user = CurrentUser.from_jwt(payload)
+    expires_in = payload.get("exp", 0) - time.time()
+    if expires_in > 0:
+        token_cache.set(key, user, ttl=expires_in)
+    return user
+
+
 def requires_auth(f):
     """Decorator for an endpoint that requires user authentication. In case of failure,
     an exception incl. HTTP status code is raised. Flask handles it and returns an error
@@ -202,21 +371,25 @@ def requires_auth(f):
 
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = get_token_from_auth_header(get_auth_string_from_header())
-        domain = os.environ["AUTH0_DOMAIN"]
-        payload = decode_jwt(
-            token=token,
-            public_key=get_public_key(domain),
-            domain=domain,
-            audience=os.environ["AUTH0_AUDIENCE"],
-        )
-        g.user = CurrentUser.from_jwt(payload)
-
+        authenticate_request()
         return f(*args, **kwargs)
 
     return decorated
 
 
+def authenticate_request():
+    """Authenticate the user of the current request by the JWT in the authorization
+    header, and store their information in the `user` attribute of the Flask g object.
+    Raise AuthenticationFailed on failure.
+    """
+    token = get_token_from_auth_header(get_auth_string_from_header())
+    g.user = get_current_user(
+        token=token,
+        domain=os.environ["AUTH0_DOMAIN"],
+        audience=os.environ["AUTH0_AUDIENCE"],
+    )
+
+
 def request_jwt(*, client_id, client_secret, audience, domain, username, password):
     """Request JWT from Auth0 service on given domain, passing any additional
     parameters. Return whether request was successful, and the full response.
@@ -54,7 +54,7 @@ def authorize(
         ):
             if value is not None:
                 break
-        raise Forbidden(resource, value, current_user.__dict__)
+        raise Forbidden(resource, value, current_user.to_dict())
 
 
 def base_filter_condition(permission):
@@ -65,7 +65,8 @@ def base_filter_condition(permission):
     if base_ids is None:
         # Permission granted for all bases
         return True
-    return Base.id << base_ids
+    # Sort for deterministic SQL statements
+    return Base.id << sorted(base_ids)
 
 
 def agreement_organisation_filter_condition():
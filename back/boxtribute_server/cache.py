@@ -0,0 +1,72 @@
+"""In-memory caching of values within a single server process."""
+import threading
+import time
+from collections import OrderedDict
+
+
+class Cache:
+    """Thread-safe key-value store holding at most `max_size` items. If the limit is
+    exceeded, the least recently used item is evicted. Items expire after `ttl` seconds
+    (never if None).
+    The `hits` and `misses` counters track the number of successful and unsuccessful
+    look-ups, resp.
+    """
+
+    def __init__(self, *, max_size=128, ttl=None, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Return value for given key, or `default` if the key is absent or expired."""
+        with self._lock:
+            try:
+                value, expires_at = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires_at is not None and expires_at <= self._clock():
+                del self._items[key]
+                self.misses += 1
+                return default
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store value for given key. If given, `ttl` overrides the cache's default."""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = None if ttl is None else self._clock() + ttl
+        with self._lock:
+            self._items[key] = (value, expires_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def get_or_set(self, key, compute, ttl=None):
+        """Return value for given key. If absent or expired, compute it by calling
+        `compute()` (without holding the lock), and store it.
+        """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = compute()
+            self.set(key, value, ttl=ttl)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
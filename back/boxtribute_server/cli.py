@@ -0,0 +1,22 @@
+"""Custom commands for the Flask command line interface"""
+import click
+from flask.cli import with_appcontext
+
+from .models.metrics import refresh_metrics_rollups
+
+
+@click.command("refresh-metrics")
+@click.option(
+    "--until",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="Aggregate transactions up to this day (excl.; default: today)",
+)
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Rebuild the metrics rollup tables from the beginning of the history",
+)
+@with_appcontext
+def refresh_metrics_command(until, full):
+    """Aggregate transactions into the daily metrics rollup tables."""
+    refresh_metrics_rollups(until=until.date() if until else None, full=full)
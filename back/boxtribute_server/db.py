@@ -1,14 +1,305 @@
+import itertools
+import os
+import threading
+
+from flask import current_app, g, has_request_context, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from peewee import Model as PeeweeModel
 from peewee import MySQLDatabase
 from playhouse.flask_utils import FlaskDB
+from playhouse.pool import MaxConnectionsExceeded, PooledMySQLDatabase
+
+from .cache import Cache
+from .instrumentation import SqlTimingMixin
+
+# Duration (in seconds) after a mutation during which reads of the user who performed it
+# are served by the primary database, in order to not miss changes that have not yet
+# been replicated
+READ_YOUR_WRITES_WINDOW = int(os.getenv("READ_YOUR_WRITES_WINDOW", 10))
+
+# Header of mutation responses holding a token that certifies the write. Clients send it
+# back with subsequent requests, which are hence served by the primary database within
+# the window, regardless of the process handling them
+READ_YOUR_WRITES_HEADER = "X-Boxtribute-Write-Token"
+
+# IDs of users who recently performed a mutation handled by this process
+recent_writers = Cache(max_size=10000, ttl=READ_YOUR_WRITES_WINDOW)
+
+
+class IdentityMap:
+    """Request-scoped registry of model instances, keyed by model class and primary
+    key. Every row is hence loaded from the database at most once per request.
+    The `hits` and `misses` counters track how many look-ups were served from the
+    registry, and how many required a database query, respectively.
+    """
+
+    def __init__(self):
+        self._instances = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model, id):
+        """Return the registered instance of the given model with the given ID, or None
+        if it is not registered.
+        """
+        instance = self._instances.get(model, {}).get(id)
+        if instance is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return instance
+
+    def __contains__(self, key):
+        model, id = key
+        return id in self._instances.get(model, {})
+
+    def add(self, instance):
+        self._instances.setdefault(type(instance), {})[instance.get_id()] = instance
+
+    def discard(self, model):
+        """Remove all registered instances of the given model (e.g. because they were
+        modified by an UPDATE or DELETE query).
+        """
+        self._instances.pop(model, None)
+
+
+def get_identity_map():
+    """Return the identity map of the current request. Outside of a request (e.g. when
+    running CLI commands or setting up tests), return None.
+    """
+    if not has_request_context():
+        return
+    return g.setdefault("identity_map", IdentityMap())
+
+
+class Model(PeeweeModel):
+    """Base class for all data models. Instances looked up by primary key, or accessed
+    via foreign-key fields (see `fields.UIntForeignKeyField`) are registered in the
+    identity map of the current request.
+    Select-queries are executed against a read replica if the current request is
+    routed to one (see `use_read_replica()`).
+    """
+
+    @classmethod
+    def select(cls, *fields):
+        query = super().select(*fields)
+        replica = get_read_replica()
+        if replica is not None:
+            query = query.bind(replica)
+        return query
+
+    @classmethod
+    def get_by_id(cls, pk):
+        identity_map = get_identity_map()
+        if identity_map is None:
+            return super().get_by_id(pk)
+
+        instance = identity_map.get(cls, pk)
+        if instance is None:
+            instance = super().get_by_id(pk)
+            identity_map.add(instance)
+        return instance
+
+    def save(self, *args, **kwargs):
+        rows = super().save(*args, **kwargs)
+        identity_map = get_identity_map()
+        if identity_map is not None and self.get_id() is not None:
+            identity_map.add(self)
+        return rows
+
+    @classmethod
+    def update(cls, *args, **kwargs):
+        cls._discard_identity_map()
+        return super().update(*args, **kwargs)
+
+    @classmethod
+    def delete(cls):
+        cls._discard_identity_map()
+        return super().delete()
+
+    @classmethod
+    def _discard_identity_map(cls):
+        # Any registered instance might be affected by the query
+        identity_map = get_identity_map()
+        if identity_map is not None:
+            identity_map.discard(cls)
+
+
+class ReplicatedFlaskDB(FlaskDB):
+    """FlaskDB with optional read replicas of the primary database, configured as list
+    of database interfaces in `app.config["DATABASE_REPLICAS"]`. Connections to
+    replicas are opened on demand, and closed at the end of the request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.replicas = []
+        self._replica_counter = itertools.count()
+        super().__init__(*args, **kwargs)
+
+    def init_app(self, app):
+        self.replicas = app.config.get("DATABASE_REPLICAS", [])
+        super().init_app(app)
+
+    def _register_handlers(self, app):
+        super()._register_handlers(app)
+        app.teardown_request(self.close_replicas)
+
+    def next_replica(self):
+        """Return a replica in round-robin fashion, or None if none configured."""
+        if not self.replicas:
+            return
+        return self.replicas[next(self._replica_counter) % len(self.replicas)]
+
+    def close_replicas(self, exc):
+        for replica in self.replicas:
+            if not replica.is_closed():
+                replica.close()
+
+
+db = ReplicatedFlaskDB(model_class=Model)
+
+
+def _write_token_serializer():
+    """Return serializer for signing write tokens with the app's secret key, or None if
+    no secret key is configured.
+    """
+    if not current_app.secret_key:
+        return
+    return URLSafeTimedSerializer(current_app.secret_key, salt="read-your-writes")
+
+
+def _is_recent_writer(user):
+    """Return whether the user performed a mutation within the last
+    `READ_YOUR_WRITES_WINDOW` seconds, according to the state of this process or to the
+    write token sent with the request.
+    """
+    if recent_writers.get(user.id):
+        return True
+    token = request.headers.get(READ_YOUR_WRITES_HEADER)
+    serializer = _write_token_serializer()
+    if token is None or serializer is None:
+        return False
+    try:
+        return serializer.loads(token, max_age=READ_YOUR_WRITES_WINDOW) == user.id
+    except BadSignature:
+        # Also raised if the token expired
+        return False
+
+
+def use_read_replica():
+    """Route the select-queries of the current request to a read replica, unless no
+    replica is configured, or the current user performed a mutation within the last
+    `READ_YOUR_WRITES_WINDOW` seconds.
+    """
+    user = g.get("user")
+    if user is not None and _is_recent_writer(user):
+        return
+    g.read_replica = db.next_replica()
+
+
+def register_write():
+    """Route the remaining queries of the current request, and the ones of the current
+    user's requests within the next `READ_YOUR_WRITES_WINDOW` seconds to the primary
+    database.
+    Since subsequent requests might be handled by other processes, a signed write token
+    is issued for the response (see `READ_YOUR_WRITES_HEADER`, and `pop_write_token()`),
+    if the app has a secret key.
+    """
+    g.pop("read_replica", None)
+    user = g.get("user")
+    if user is not None:
+        recent_writers.set(user.id, True)
+        serializer = _write_token_serializer()
+        if serializer is not None:
+            g.write_token = serializer.dumps(user.id)
+
+
+def pop_write_token():
+    """Return the write token issued for the current request, or None."""
+    return g.pop("write_token", None)
+
+
+def get_read_replica():
+    """Return the read replica that the current request is routed to, or None (also
+    outside of a request).
+    """
+    if not has_request_context():
+        return
+    return g.get("read_replica")
+
+
+class InstrumentedMySQLDatabase(SqlTimingMixin, MySQLDatabase):
+    pass
+
+
+class InstrumentedPooledMySQLDatabase(SqlTimingMixin, PooledMySQLDatabase):
+    """Pool of MySQL connections. Connections are returned to the pool instead of being
+    closed at the end of a request (see `FlaskDB.close_db`), and re-used by subsequent
+    requests. On check-out, connections are pinged, and discarded if they were closed by
+    the server, resp. if they are older than the stale timeout.
+    The connection state of peewee databases is thread-local, hence every thread of a
+    gunicorn worker checks out its own connection. If all connections are in use, the
+    check-out waits for one to be returned; the number of such waits is counted.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.waits = 0
+        self._checkout = threading.local()
+        super().__init__(*args, **kwargs)
+
+    def connect(self, reuse_if_open=False):
+        try:
+            return super().connect(reuse_if_open)
+        finally:
+            self._checkout.waiting = False
+
+    def _connect(self):
+        # Executed while holding the database lock
+        try:
+            return super()._connect()
+        except MaxConnectionsExceeded:
+            # The check-out is retried until timeout; count the wait only once
+            if not getattr(self._checkout, "waiting", False):
+                self._checkout.waiting = True
+                self.waits += 1
+            raise
 
-db = FlaskDB()
+    def pool_statistics(self):
+        """Return numbers of connections in use and idle, the maximum number of
+        connections, and the number of check-outs that had to wait.
+        """
+        with self._lock:
+            return {
+                "in_use": len(self._in_use),
+                "idle": len(self._connections),
+                "max": self._max_connections,
+                "waits": self.waits,
+            }
 
 
-def create_db_interface(**mysql_kwargs):
+def create_db_interface(
+    *,
+    pool_max_connections=None,
+    pool_stale_timeout=300,
+    pool_timeout=10,
+    **mysql_kwargs
+):
     """Create MySQL database interface using given connection parameters. `mysql_kwargs`
     are forwarded to `pymysql.connect`.
+    If `pool_max_connections` is given, create a connection pool of that size.
+    Connections older than `pool_stale_timeout` seconds are closed instead of re-used.
+    If all connections are in use, wait up to `pool_timeout` seconds for one to be
+    returned.
     Configure primary keys to be unsigned integer.
+    Executed SQL queries are reported to the tracing of the current request.
     """
-    return MySQLDatabase(
-        **mysql_kwargs, field_types={"AUTO": "INTEGER UNSIGNED AUTO_INCREMENT"}
+    field_types = {"AUTO": "INTEGER UNSIGNED AUTO_INCREMENT"}
+    if pool_max_connections is None:
+        return InstrumentedMySQLDatabase(**mysql_kwargs, field_types=field_types)
+    return InstrumentedPooledMySQLDatabase(
+        **mysql_kwargs,
+        max_connections=pool_max_connections,
+        stale_timeout=pool_stale_timeout,
+        timeout=pool_timeout,
+        field_types=field_types,
     )
@@ -55,6 +55,25 @@ class BoxCreationFailed(Exception):
     }
 
 
+class InvalidBoxCount(Exception):
+    def __init__(self, *args, maximum, **kwargs):
+        self.extensions = {
+            "code": "BAD_USER_INPUT",
+            "description": f"At most {maximum} boxes can be created at once.",
+        }
+        super().__init__(*args, **kwargs)
+
+
+class InvalidQrCodeCount(Exception):
+    def __init__(self, *args, maximum, **kwargs):
+        self.extensions = {
+            "code": "BAD_USER_INPUT",
+            "description": "The number of QR codes to create must be between 1 and "
+            f"{maximum}.",
+        }
+        super().__init__(*args, **kwargs)
+
+
 class Forbidden(Exception):
     def __init__(self, resource, value, user, *args, **kwargs):
         self.extensions = {
@@ -123,3 +142,11 @@ class InvalidPaginationInput(Exception):
         "code": "BAD_USER_INPUT",
         "description": "Invalid pagination input: missing 'before' field.",
     }
+
+
+class InvalidPaginationCursor(Exception):
+    extensions = {
+        "code": "BAD_USER_INPUT",
+        "description": "Invalid pagination input: malformed cursor, or cursor not "
+        "matching the requested order.",
+    }
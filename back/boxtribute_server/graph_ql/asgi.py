@@ -0,0 +1,135 @@
+"""Serving of the GraphQL APIs via ASGI.
+
+Resolvers are executed in a thread pool such that independent fields are resolved
+concurrently (see `execution.execute_graphql_async()`). Select-queries returned by
+resolvers are evaluated in the thread pool as well. However default resolvers (e.g.
+accessing foreign-key or back-reference fields of model instances) run in the event
+loop and might block it on database I/O.
+
+Resolvers, authentication, and database handling depend on the Flask request context
+(e.g. `flask.g` holds the current user, loaders, and identity map). Hence every
+request is executed within a request context of the given Flask app.
+"""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from ariadne.asgi import GraphQL
+from ariadne.exceptions import HttpError
+from flask import request as flask_request
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+from werkzeug.test import EnvironBuilder
+
+from ..auth import authenticate_request
+from ..db import READ_YOUR_WRITES_HEADER, pop_write_token
+from ..exceptions import AuthenticationFailed, format_database_errors
+from ..routes import graphql_extensions
+from .cost import QUERY_API_COST_LIMIT
+from .execution import execute_graphql_async
+from .schema import full_api_schema, query_api_schema
+
+# Maximum number of resolvers executed in parallel per process. When using a pooled
+# database interface, the pool should hold at least that many connections
+ASGI_RESOLVER_THREADS = int(os.getenv("ASGI_RESOLVER_THREADS", 16))
+
+
+class FlaskContextGraphQL(GraphQL):
+    """ASGI application executing GraphQL requests against the schema, within a request
+    context of the given Flask app. Requests are authenticated like the ones to the
+    Flask app's GraphQL endpoints.
+    """
+
+    def __init__(self, schema, *, flask_app, executor, cost_limit=None, **kwargs):
+        super().__init__(schema, error_formatter=format_database_errors, **kwargs)
+        self.flask_app = flask_app
+        self.executor = executor
+        self.cost_limit = cost_limit
+
+    async def graphql_http_server(self, request):
+        try:
+            data = await self.extract_data_from_request(request)
+        except HttpError as error:
+            return PlainTextResponse(error.message or error.status, status_code=400)
+
+        environ = EnvironBuilder(
+            path=request.url.path,
+            method=request.method,
+            headers=list(request.headers.items()),
+        ).get_environ()
+        # Database connections opened in the event loop's thread (e.g. by default
+        # resolvers accessing foreign-key fields) are closed on tear-down
+        with self.flask_app.request_context(environ):
+            return await self._execute(data)
+
+    async def _execute(self, data):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        try:
+            # Fetching public keys for token validation might block
+            await loop.run_in_executor(self.executor, context.run, authenticate_request)
+        except AuthenticationFailed as error:
+            return JSONResponse(error.error, status_code=error.status_code)
+
+        success, result = await execute_graphql_async(
+            self.schema,
+            data,
+            context_value=flask_request,
+            debug=self.debug,
+            introspection=self.introspection,
+            error_formatter=self.error_formatter,
+            extensions=graphql_extensions(),
+            cost_limit=self.cost_limit,
+            executor=self.executor,
+        )
+        status_code = 200 if success else 400
+        headers = {}
+        write_token = pop_write_token()
+        if write_token is not None:
+            headers[READ_YOUR_WRITES_HEADER] = write_token
+        return JSONResponse(result, status_code=status_code, headers=headers)
+
+
+def create_asgi_app(flask_app, *, expose_full_graphql=False, executor=None):
+    """Create ASGI app serving the query-only API at '/', or the full API at '/graphql'
+    (mirroring the Flask blueprints `api_bp` and `app_bp`, resp.).
+    """
+    executor = executor or ThreadPoolExecutor(
+        max_workers=ASGI_RESOLVER_THREADS, thread_name_prefix="resolver"
+    )
+    introspection = os.getenv("FLASK_ENV") == "development"
+    if expose_full_graphql:
+        path = "/graphql"
+        graphql_app = FlaskContextGraphQL(
+            full_api_schema,
+            flask_app=flask_app,
+            executor=executor,
+            debug=bool(os.getenv("DEBUG_GRAPHQL", False)),
+            introspection=introspection,
+        )
+    else:
+        path = "/"
+        graphql_app = FlaskContextGraphQL(
+            query_api_schema,
+            flask_app=flask_app,
+            executor=executor,
+            cost_limit=QUERY_API_COST_LIMIT,
+            introspection=introspection,
+        )
+
+    return Starlette(
+        routes=[Route(path, graphql_app)],
+        middleware=[
+            Middleware(
+                CORSMiddleware,
+                allow_origins=["*"],
+                allow_methods=["*"],
+                allow_headers=["*"],
+                expose_headers=[READ_YOUR_WRITES_HEADER],
+            )
+        ],
+    )
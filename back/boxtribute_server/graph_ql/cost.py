@@ -0,0 +1,166 @@
+"""Static estimation of the cost of GraphQL queries.
+
+The cost estimates the number of objects that have to be resolved for a query, i.e.
+fields of object type (or lists of it) count one per parent object, and scalar fields
+are free (unless assigned an extra weight). Lists and pages multiply the cost of their
+elements:
+- for fields returning a `*Page` type, by the page size requested via `paginationInput`
+  (`first` or `last`; default `DEFAULT_PAGE_SIZE`), applied to the `elements` field
+- for other list fields, by an assumed list size (see `LIST_SIZES`)
+
+E.g. `bases { beneficiaries { elements { id } } }` costs
+    20 (bases) * (1 (base) + 1 (page) + 50 (elements)) = 1040
+"""
+import os
+
+from graphql import (
+    FieldNode,
+    FragmentSpreadNode,
+    GraphQLError,
+    GraphQLList,
+    GraphQLNonNull,
+    GraphQLObjectType,
+    OperationDefinitionNode,
+    OperationType,
+    get_named_type,
+)
+from graphql.execution.values import get_argument_values
+
+from .pagination import DEFAULT_PAGE_SIZE
+
+# Maximum cost of queries to the query-only API
+QUERY_API_COST_LIMIT = int(os.getenv("QUERY_API_COST_LIMIT", 10000))
+# Assumed number of elements of list fields (`Type.field`), or by default
+DEFAULT_LIST_SIZE = 20
+LIST_SIZES = {
+    "Beneficiary.languages": 3,
+    "Beneficiary.transactions": 50,
+}
+# Additional weights of fields whose resolution requires extra database queries
+FIELD_WEIGHTS = {
+    "Beneficiary.tokens": 1,
+    "Metrics.numberOfBeneficiariesServed": 10,
+    "Metrics.numberOfFamiliesServed": 10,
+    "Metrics.numberOfSales": 10,
+    "BeneficiaryPage.totalCount": 10,
+    "BoxPage.totalCount": 10,
+    "ProductPage.totalCount": 10,
+}
+
+
+class QueryCostExceeded(GraphQLError):
+    def __init__(self, cost, limit):
+        super().__init__(
+            f"The query exceeds the maximum cost of {limit}. Actual cost is {cost}",
+            extensions={
+                "code": "BAD_USER_INPUT",
+                "cost": {"requestedQueryCost": cost, "maximumAvailable": limit},
+            },
+        )
+
+
+def _is_list(field_type):
+    if isinstance(field_type, GraphQLNonNull):
+        field_type = field_type.of_type
+    return isinstance(field_type, GraphQLList)
+
+
+class _CostEstimator:
+    def __init__(self, fragments, variables):
+        self.fragments = fragments
+        self.variables = variables or {}
+
+    def _field_nodes(self, selection_set, parent_type):
+        """Yield field nodes of the selection set, including the ones of fragments
+        that apply to the parent type.
+        """
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                yield selection
+                continue
+
+            if isinstance(selection, FragmentSpreadNode):
+                fragment = self.fragments.get(selection.name.value)
+                if fragment is None:
+                    continue
+            else:
+                fragment = selection
+            type_condition = fragment.type_condition
+            if type_condition is None or type_condition.name.value == parent_type.name:
+                yield from self._field_nodes(fragment.selection_set, parent_type)
+
+    def _page_size(self, field, node):
+        try:
+            arguments = get_argument_values(field, node, self.variables)
+        except GraphQLError:
+            # Invalid variables are reported when executing the query
+            arguments = {}
+        pagination_input = arguments.get("paginationInput") or {}
+        page_size = (
+            pagination_input.get("first")
+            or pagination_input.get("last")
+            or DEFAULT_PAGE_SIZE
+        )
+        # Negative page sizes must not decrease the cost of the query
+        return max(abs(page_size), 1)
+
+    def selection_cost(self, selection_set, parent_type, page_size=None):
+        """Compute cost of the selection set on the given parent type. For `*Page`
+        types, the page size multiplies the cost of the `elements` field.
+        """
+        total = 0
+        for node in self._field_nodes(selection_set, parent_type):
+            name = node.name.value
+            field = parent_type.fields.get(name)
+            if field is None:
+                continue
+
+            key = f"{parent_type.name}.{name}"
+            field_type = get_named_type(field.type)
+            cost = FIELD_WEIGHTS.get(key, 0)
+            if isinstance(field_type, GraphQLObjectType):
+                child_page_size = None
+                if field_type.name.endswith("Page"):
+                    child_page_size = self._page_size(field, node)
+                cost += 1 + self.selection_cost(
+                    node.selection_set, field_type, child_page_size
+                )
+
+            if page_size is not None and name == "elements":
+                cost *= page_size
+            elif _is_list(field.type):
+                cost *= LIST_SIZES.get(key, DEFAULT_LIST_SIZE)
+            total += cost
+        return total
+
+
+def estimate_query_cost(schema, document, *, variables=None, operation_name=None):
+    """Estimate the cost of the operation of given name (default: the only one) in the
+    document. Return 0 if the operation can't be determined (execution then fails
+    anyways).
+    """
+    operations = [
+        d for d in document.definitions if isinstance(d, OperationDefinitionNode)
+    ]
+    if operation_name is not None:
+        operations = [
+            o for o in operations if o.name and o.name.value == operation_name
+        ]
+    if len(operations) != 1:
+        return 0
+
+    operation = operations[0]
+    root_type = {
+        OperationType.QUERY: schema.query_type,
+        OperationType.MUTATION: schema.mutation_type,
+    }.get(operation.operation)
+    if root_type is None:
+        return 0
+
+    fragments = {
+        d.name.value: d
+        for d in document.definitions
+        if not isinstance(d, OperationDefinitionNode)
+    }
+    estimator = _CostEstimator(fragments, variables)
+    return estimator.selection_cost(operation.selection_set, root_type)
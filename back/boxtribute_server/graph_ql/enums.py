@@ -18,4 +18,18 @@ enum_types = [
     EnumType("ShipmentState", ShipmentState),
     EnumType("TransferAgreementState", TransferAgreementState),
     EnumType("TransferAgreementType", TransferAgreementType),
+    # Map to names of model fields
+    EnumType(
+        "BeneficiaryOrderField",
+        {
+            "firstName": "first_name",
+            "lastName": "last_name",
+            "groupIdentifier": "group_identifier",
+            "createdOn": "created_on",
+        },
+    ),
+    EnumType(
+        "BoxOrderField",
+        {"labelIdentifier": "label_identifier", "lastModifiedOn": "last_modified_on"},
+    ),
 ]
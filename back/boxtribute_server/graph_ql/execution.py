@@ -0,0 +1,342 @@
+"""Execution of GraphQL requests, with caching of query documents.
+
+The front-end sends the same few query documents over and over. To avoid parsing and
+validating them on every request, validated documents are cached, keyed by the SHA-256
+hash of the query string.
+
+Clients may furthermore use Automatic Persisted Queries (APQ, see
+https://www.apollographql.com/docs/apollo-server/performance/apq/): instead of the
+query string, only its hash is sent in the request data
+    {"extensions": {"persistedQuery": {"version": 1, "sha256Hash": "..."}}}
+If the hash is unknown to the server, a PERSISTED_QUERY_NOT_FOUND error is returned,
+and the client repeats the request including the query string. The query is then
+registered under the hash.
+
+If read replicas are configured, queries are executed against one of them, while
+mutations are executed against the primary database (see `db.use_read_replica()`).
+
+Requests are executed synchronously (WSGI), or asynchronously with resolvers running in
+a thread pool (ASGI, see `asgi` module).
+"""
+import asyncio
+import contextvars
+import hashlib
+import os
+import threading
+import time
+from inspect import isawaitable
+
+from ariadne.contrib.tracing.utils import should_trace
+from ariadne.extensions import ExtensionManager
+from ariadne.format_error import format_error
+from ariadne.graphql import (
+    handle_graphql_errors,
+    handle_query_result,
+    parse_query,
+    validate_data,
+    validate_query,
+)
+from graphql import (
+    ExecutionContext,
+    GraphQLError,
+    MiddlewareManager,
+    OperationType,
+    execute,
+    get_operation_ast,
+)
+from peewee import SelectBase
+
+from ..cache import Cache
+from ..db import db, register_write, use_read_replica
+from .cost import QueryCostExceeded, estimate_query_cost
+
+# Maximum number of query strings registered by Automatic Persisted Queries
+PERSISTED_QUERY_CACHE_SIZE = int(os.getenv("PERSISTED_QUERY_CACHE_SIZE", 1024))
+# Maximum number of parsed and validated query documents
+DOCUMENT_CACHE_SIZE = int(os.getenv("DOCUMENT_CACHE_SIZE", 256))
+
+persisted_queries = Cache(max_size=PERSISTED_QUERY_CACHE_SIZE)
+document_cache = Cache(max_size=DOCUMENT_CACHE_SIZE)
+
+# Database connections opened by resolver threads are re-used by subsequent resolvers
+# run in the same thread. They are closed before use if idle for longer than this many
+# seconds, since the MySQL server might have closed them meanwhile (`wait_timeout`)
+RESOLVER_CONNECTION_IDLE_TIMEOUT = int(
+    os.getenv("RESOLVER_CONNECTION_IDLE_TIMEOUT", 300)
+)
+_resolver_thread_state = threading.local()
+
+
+class PersistedQueryNotFound(GraphQLError):
+    def __init__(self):
+        super().__init__(
+            "PersistedQueryNotFound",
+            extensions={"code": "PERSISTED_QUERY_NOT_FOUND"},
+        )
+
+
+class PersistedQueryHashMismatch(GraphQLError):
+    def __init__(self):
+        super().__init__(
+            "Provided sha256Hash does not match query",
+            extensions={"code": "BAD_USER_INPUT"},
+        )
+
+
+class PersistedQueryInvalidHash(GraphQLError):
+    def __init__(self):
+        super().__init__(
+            "Provided sha256Hash must be a string",
+            extensions={"code": "BAD_USER_INPUT"},
+        )
+
+
+def _query_hash(query):
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+def _resolve_persisted_query(data):
+    """Return the request data with the query string filled in from the registered
+    persisted queries, if the data only contains the query hash. If both the query
+    string and its hash are given, register the query.
+    Raise PersistedQueryNotFound if the hash is unknown, PersistedQueryHashMismatch if
+    the hash does not match the given query string, or PersistedQueryInvalidHash if the
+    hash is not a string.
+    """
+    if not isinstance(data, dict):
+        return data
+    persisted_query = (data.get("extensions") or {}).get("persistedQuery")
+    if not isinstance(persisted_query, dict):
+        return data
+
+    query_hash = persisted_query.get("sha256Hash")
+    if not isinstance(query_hash, str):
+        raise PersistedQueryInvalidHash()
+    query = data.get("query")
+    if query is None:
+        query = persisted_queries.get(query_hash)
+        if query is None:
+            raise PersistedQueryNotFound()
+        return {**data, "query": query}
+
+    if _query_hash(query) != query_hash:
+        raise PersistedQueryHashMismatch()
+    persisted_queries.set(query_hash, query)
+    return data
+
+
+def _get_validated_document(schema, query, *, introspection):
+    """Return the document parsed from the query, and a list of validation errors.
+    Documents that pass validation are cached, and returned without re-parsing or
+    re-validating.
+    """
+    # Validation depends on the schema, and on whether introspection is enabled
+    key = (id(schema), introspection, _query_hash(query))
+    document = document_cache.get(key)
+    if document is not None:
+        return document, []
+
+    document = parse_query(query)
+    errors = validate_query(schema, document, enable_introspection=introspection)
+    if not errors:
+        document_cache.set(key, document)
+    return document, errors
+
+
+def _prepare_execution(schema, data, *, introspection, cost_limit):
+    """Resolve persisted query, and return request data, validated document, validation
+    errors, and the estimated cost of the query (None if no cost limit is given).
+    Raise QueryCostExceeded if the query exceeds the cost limit.
+    Route the queries of the request to a read replica, unless it is a mutation.
+    """
+    data = _resolve_persisted_query(data)
+    validate_data(data)
+    document, validation_errors = _get_validated_document(
+        schema, data["query"], introspection=introspection
+    )
+    if validation_errors:
+        return data, document, validation_errors, None
+
+    cost = None
+    if cost_limit is not None:
+        # The cost depends on variables, hence it's not cached with the document
+        cost = estimate_query_cost(
+            schema,
+            document,
+            variables=data.get("variables"),
+            operation_name=data.get("operationName"),
+        )
+        if cost > cost_limit:
+            raise QueryCostExceeded(cost, cost_limit)
+
+    operation = get_operation_ast(document, data.get("operationName"))
+    if operation is not None:
+        if operation.operation == OperationType.MUTATION:
+            register_write()
+        else:
+            use_read_replica()
+    return data, document, [], cost
+
+
+def _handle_result(result, *, cost, cost_limit, **result_kwargs):
+    success, response = handle_query_result(result, **result_kwargs)
+    if cost_limit is not None:
+        response.setdefault("extensions", {})["cost"] = {
+            "requestedQueryCost": cost,
+            "maximumAvailable": cost_limit,
+        }
+    return success, response
+
+
+def execute_graphql(
+    schema,
+    data,
+    *,
+    context_value=None,
+    debug=False,
+    introspection=True,
+    error_formatter=format_error,
+    extensions=None,
+    cost_limit=None,
+):
+    """Execute the GraphQL request of given data against the schema. Return a pair of
+    a success flag and the response data.
+    This mimics `ariadne.graphql_sync()` but resolves persisted queries, and uses the
+    document cache (see module docstring).
+    If a cost limit is given, estimate the cost of the query (see `cost` module), and
+    reject it if it exceeds the limit. The cost is reported in the response extensions.
+    """
+    extension_manager = ExtensionManager(extensions, context_value)
+    result_kwargs = dict(
+        logger=None,
+        error_formatter=error_formatter,
+        debug=debug,
+        extension_manager=extension_manager,
+    )
+
+    with extension_manager.request():
+        try:
+            data, document, validation_errors, cost = _prepare_execution(
+                schema, data, introspection=introspection, cost_limit=cost_limit
+            )
+            if validation_errors:
+                return handle_graphql_errors(validation_errors, **result_kwargs)
+
+            result = execute(
+                schema,
+                document,
+                context_value=context_value,
+                variable_values=data.get("variables"),
+                operation_name=data.get("operationName"),
+                execution_context_class=ExecutionContext,
+                middleware=extension_manager.as_middleware_manager(None),
+            )
+        except GraphQLError as error:
+            return handle_graphql_errors([error], **result_kwargs)
+        else:
+            return _handle_result(
+                result, cost=cost, cost_limit=cost_limit, **result_kwargs
+            )
+
+
+def _close_idle_connections():
+    """Close the database connections of the current thread if they have not been used
+    for longer than `RESOLVER_CONNECTION_IDLE_TIMEOUT`.
+    """
+    last_used = getattr(_resolver_thread_state, "last_used", None)
+    if (
+        last_used is not None
+        and time.monotonic() - last_used > RESOLVER_CONNECTION_IDLE_TIMEOUT
+    ):
+        db.close_db(None)
+        db.close_replicas(None)
+
+
+def _resolve_in_thread(executor):
+    """Return middleware that runs resolvers (except default ones) in threads of the
+    executor, and returns awaitables of their results. Sibling fields are hence resolved
+    concurrently.
+    Resolvers run in a copy of the current context, i.e. they have access to the Flask
+    request context. Select-queries returned by resolvers are evaluated in the thread,
+    too. Database connections opened by a thread are kept open for subsequent resolvers
+    (of the current and following requests), such that at most one connection per
+    database is opened per thread of the executor.
+    """
+
+    def run(context, next_, parent, info, kwargs):
+        _close_idle_connections()
+        try:
+            result = context.run(next_, parent, info, **kwargs)
+            if isinstance(result, SelectBase):
+                result = list(result)
+            return result
+        finally:
+            _resolver_thread_state.last_used = time.monotonic()
+
+    def resolve(next_, parent, info, **kwargs):
+        if not should_trace(info):
+            return next_(parent, info, **kwargs)
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return loop.run_in_executor(executor, run, context, next_, parent, info, kwargs)
+
+    return resolve
+
+
+async def execute_graphql_async(
+    schema,
+    data,
+    *,
+    context_value=None,
+    debug=False,
+    introspection=True,
+    error_formatter=format_error,
+    extensions=None,
+    cost_limit=None,
+    executor=None,
+):
+    """Asynchronous variant of `execute_graphql()`. Resolvers are run in threads of the
+    given executor (default: the event loop's default executor), such that independent
+    fields (e.g. the fields of `Metrics`, or sibling top-level fields) are resolved
+    concurrently.
+    Extensions are applied within the resolver threads, hence their records are only
+    accurate for sequentially resolved fields.
+    """
+    extension_manager = ExtensionManager(extensions, context_value)
+    result_kwargs = dict(
+        logger=None,
+        error_formatter=error_formatter,
+        debug=debug,
+        extension_manager=extension_manager,
+    )
+
+    with extension_manager.request():
+        try:
+            data, document, validation_errors, cost = _prepare_execution(
+                schema, data, introspection=introspection, cost_limit=cost_limit
+            )
+            if validation_errors:
+                return handle_graphql_errors(validation_errors, **result_kwargs)
+
+            # The last middleware is the outermost, i.e. extensions are run in the
+            # resolver thread
+            middleware = MiddlewareManager(
+                *extension_manager.extensions, _resolve_in_thread(executor)
+            )
+            result = execute(
+                schema,
+                document,
+                context_value=context_value,
+                variable_values=data.get("variables"),
+                operation_name=data.get("operationName"),
+                execution_context_class=ExecutionContext,
+                middleware=middleware,
+            )
+            if isawaitable(result):
+                result = await result
+        except GraphQLError as error:
+            return handle_graphql_errors([error], **result_kwargs)
+        else:
+            return _handle_result(
+                result, cost=cost, cost_limit=cost_limit, **result_kwargs
+            )
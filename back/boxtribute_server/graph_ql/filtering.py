@@ -1,6 +1,17 @@
+import functools
+import operator
+import re
+
+from playhouse.mysql_ext import Match
+
 from ..models.definitions.beneficiary import Beneficiary
 from ..models.definitions.box import Box
 
+# Shortest words contained in a MySQL InnoDB full-text index (innodb_ft_min_token_size)
+FULLTEXT_MIN_WORD_LENGTH = 3
+# Characters with special meaning in boolean full-text searches
+FULLTEXT_OPERATORS = re.compile(r'[+\-<>()~*"@]')
+
 
 def derive_beneficiary_filter(filter_input):
     """Derive filter condition for select-query from given filter parameters. If no
@@ -41,15 +52,38 @@ def derive_beneficiary_filter(filter_input):
 
     pattern = filter_input.get("pattern")
     if pattern is not None:
-        condition &= (
-            (Beneficiary.last_name.contains(pattern))
-            | (Beneficiary.first_name.contains(pattern))
-            | (Beneficiary.comment.contains(pattern))
-            | (Beneficiary.group_identifier == pattern)
-        )
+        condition &= _beneficiary_pattern_condition(pattern)
     return condition
 
 
+def _beneficiary_pattern_condition(pattern):
+    """Derive condition for beneficiaries where each word of the given pattern is the
+    beginning of a word in first name, last name, or comment, or where the pattern
+    matches the group identifier.
+    Words that are long enough to be contained in the full-text index are searched for
+    via the index. Shorter words are searched for as beginning of the text fields, or
+    as following a space in them.
+    """
+    words = FULLTEXT_OPERATORS.sub(" ", pattern).split()
+    long_words = [w for w in words if len(w) >= FULLTEXT_MIN_WORD_LENGTH]
+    text_fields = (Beneficiary.first_name, Beneficiary.last_name, Beneficiary.comment)
+
+    text_condition = True
+    if long_words:
+        text_condition &= Match(
+            text_fields,
+            " ".join(f"+{w}*" for w in long_words),
+            modifier="IN BOOLEAN MODE",
+        )
+    for word in words:
+        if len(word) < FULLTEXT_MIN_WORD_LENGTH:
+            text_condition &= functools.reduce(
+                operator.or_,
+                [f.startswith(word) | f.contains(f" {word}") for f in text_fields],
+            )
+    return (text_condition) | (Beneficiary.group_identifier == pattern)
+
+
 def derive_box_filter(filter_input):
     """Derive filter condition for select-query from given filter parameters. If no
     parameters given, return True (i.e. no filtering applied).
@@ -0,0 +1,197 @@
+"""Per-request batch loading of model instances referenced by foreign-key fields.
+
+Resolving e.g. the product of every box on a BoxPage via peewee's lazy foreign-key
+accessor (`box.product`) issues one select query per box. Instead, the elements of a
+page (or list) are registered with the loaders before any of their fields are resolved
+(see `prime_loaders()`). When the first foreign-key field of an element is
+resolved, the loader of the referenced model fetches the instances for all pending IDs
+at once, i.e. in a single `SELECT ... WHERE id IN (...)` query. The number of queries
+per page hence does not depend on the page size.
+Likewise, values derived from the elements themselves (e.g. the token balance of a
+beneficiary) are computed for all elements in a single query by BatchLoaders.
+
+The loaders are stored in the Flask g object, and are reset at the beginning of every
+request (see `routes.reset_request_state()`). Loaded instances are shared with the
+request's identity map (see `db.IdentityMap`).
+When resolvers run concurrently (see `execution.execute_graphql_async()`), loads are
+serialized per loader, so that concurrent loads wait for the batch in progress instead
+of issuing separate queries.
+"""
+import threading
+from abc import ABC, abstractmethod
+
+from flask import g
+from peewee import ForeignKeyField, fn
+
+from ..db import get_identity_map
+from ..models.definitions.beneficiary import Beneficiary
+from ..models.definitions.transaction import Transaction
+from ..models.definitions.x_beneficiary_language import XBeneficiaryLanguage
+
+
+class ModelLoader:
+    """Loader for instances of a single model, keyed by ID. Loaded instances are
+    registered in the identity map of the current request.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._pending_ids = set()
+        self._lock = threading.Lock()
+
+    def prime(self, ids):
+        """Register IDs of instances that are loaded with the next batch."""
+        identity_map = get_identity_map()
+        ids = {i for i in ids if i is not None and (self.model, i) not in identity_map}
+        with self._lock:
+            self._pending_ids.update(ids)
+
+    def load(self, id):
+        """Return the instance with the given ID. If it has not been loaded yet, load it
+        together with all pending instances.
+        Return None if the ID is None. Raise a DoesNotExist exception if the instance
+        does not exist in the database.
+        """
+        if id is None:
+            return
+        with self._lock:
+            instance = get_identity_map().get(self.model, id)
+            if instance is not None:
+                return instance
+
+            self._pending_ids.add(id)
+            try:
+                return self._load_pending()[id]
+            except KeyError:
+                raise self.model.DoesNotExist(
+                    f"<Model: {self.model.__name__}> instance matching ID {id} does "
+                    "not exist"
+                )
+
+    def _load_pending(self):
+        ids, self._pending_ids = self._pending_ids, set()
+        identity_map = get_identity_map()
+        instances = {}
+        for instance in self.model.select().where(self.model.id << list(ids)):
+            identity_map.add(instance)
+            instances[instance.id] = instance
+        return instances
+
+
+class BatchLoader(ABC):
+    """Base class for loaders of values derived from instances of `model`, keyed by
+    instance ID (e.g. aggregates over rows of another table referencing the instance).
+    Derived classes implement `fetch()`. IDs without fetched value are assigned the
+    `default` value.
+    """
+
+    model = None
+    default = None
+
+    def __init__(self):
+        self._values = {}
+        self._pending_ids = set()
+        self._lock = threading.Lock()
+
+    def prime(self, ids):
+        """Register IDs of instances whose values are loaded with the next batch."""
+        ids = set(ids)
+        with self._lock:
+            self._pending_ids.update(ids - self._values.keys())
+
+    def load(self, id):
+        """Return the value for the given ID. If it has not been loaded yet, load it
+        together with all pending values.
+        """
+        with self._lock:
+            if id not in self._values:
+                self._pending_ids.add(id)
+                ids, self._pending_ids = list(self._pending_ids), set()
+                values = self.fetch(ids)
+                for i in ids:
+                    self._values[i] = values.get(i, self.default)
+            return self._values[id]
+
+    @abstractmethod
+    def fetch(self, ids):
+        """Return a dictionary of values for the given IDs."""
+
+
+class BeneficiaryTokensLoader(BatchLoader):
+    """Loader for the token balances of beneficiaries (sum of the tokens of all their
+    transactions). Beneficiaries without transactions have a balance of zero.
+    """
+
+    model = Beneficiary
+    default = 0
+
+    def fetch(self, ids):
+        return dict(
+            Transaction.select(Transaction.beneficiary, fn.sum(Transaction.tokens))
+            .where(Transaction.beneficiary << ids)
+            .group_by(Transaction.beneficiary)
+            .tuples()
+        )
+
+
+class BeneficiaryLanguagesLoader(BatchLoader):
+    """Loader for the IDs of the languages of beneficiaries."""
+
+    model = Beneficiary
+    default = ()
+
+    def fetch(self, ids):
+        languages = {}
+        for beneficiary_id, language_id in (
+            XBeneficiaryLanguage.select(
+                XBeneficiaryLanguage.beneficiary, XBeneficiaryLanguage.language
+            )
+            .where(XBeneficiaryLanguage.beneficiary << ids)
+            .tuples()
+        ):
+            languages.setdefault(beneficiary_id, []).append(language_id)
+        return languages
+
+
+def get_loader(key):
+    """Return the loader for the current request. `key` is either a model class (the
+    loader returns its instances), or a BatchLoader class.
+    """
+    loaders = g.setdefault("loaders", {})
+    if key not in loaders:
+        loader = key() if issubclass(key, BatchLoader) else ModelLoader(key)
+        # Keep the loader of a concurrent resolver that registered one first
+        loaders.setdefault(key, loader)
+    return loaders[key]
+
+
+def load_related(instance, name):
+    """Return the model instance referenced by the foreign-key field of given name. If
+    it is already available (e.g. from a select query that joined the referenced model)
+    return it directly, otherwise use the loader of the referenced model.
+    """
+    if name in instance.__rel__:
+        return instance.__rel__[name]
+    field = getattr(type(instance), name)
+    return get_loader(field.rel_model).load(instance.__data__.get(name))
+
+
+def prime_loaders(elements):
+    """Register the IDs referenced by the foreign-key fields of the given model instances
+    with the corresponding loaders. Also register the IDs of the instances with the
+    BatchLoaders of their model. Return the elements as list.
+    """
+    elements = list(elements)
+    if not elements:
+        return elements
+
+    model = type(elements[0])
+    for field in model._meta.sorted_fields:
+        if isinstance(field, ForeignKeyField):
+            get_loader(field.rel_model).prime(
+                element.__data__.get(field.name) for element in elements
+            )
+    for loader_class in BatchLoader.__subclasses__():
+        if loader_class.model is model:
+            get_loader(loader_class).prime(element.id for element in elements)
+    return elements
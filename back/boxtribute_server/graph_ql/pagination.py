@@ -1,7 +1,8 @@
 """Utility functions for pagination.
 
 The program uses cursor style pagination, consisting of two steps: fetching the actual
-content of the page, and determining page meta data.
+content of the page, and determining page meta data. Both the page elements and the
+information required for the page meta data are fetched in a single query.
 
 The following explains forward pagination. Assume a model holding 9 elements
 (represented by their IDs)
@@ -14,11 +15,15 @@ computation of the existence of a next page, the given limit (3) must be increas
 This way the first 4 elements are obtained.
          |-------|
     Model 1 2 3 4 5 6 7 8 9
+Since the start cursor is 0, no elements before the slice can exist. Otherwise the query
+would be extended by a column indicating whether any element up to and including the
+start cursor exists
+    model.select(..., EXISTS(model.select().where(model.id <= cursor)))
 For determining the page meta data, the algorithm (`_generate_page_info()` function)
 - notices that the size of the slice (4) extends the requested limit (3), hence a next
   page exists
-- queries the model for any elements before the first one of the slice (ID 1). Since
-there aren't any, no previous page exists
+- notices that no elements before the first one of the slice (ID 1) can exist, hence no
+  previous page exists
 - assigns the first element (ID 1) as the start cursor
 - assigns the second-to-last element (ID 3) as the end cursor
 Eventually, the page meta data, and first 3 elements (IDs 1, 2, 3) are returned.
@@ -31,14 +36,37 @@ selects
 The algorithm
 - notices that the slice size (3) is not larger than the requested limit (3), hence no
   next page exists
-- finds an element before ID 7, hence a previous page exists
+- reads from the additional column that an element before ID 7 exists, hence a
+  previous page exists
 - assigns ID 7 as start and ID 9 as end cursor
 
 For backward pagination, the procedure works in reverse.
+
+Instead of by ID, elements can be ordered by a sort field (e.g. last name); elements
+with equal sort field values are ordered by ID. The cursors then encode both sort field
+value and ID of an element, and the selection compares against both (keyset
+pagination).
 """
 import base64
+import binascii
+import json
+import os
+
+from peewee import SQL, fn
+
+from ..cache import Cache
+from ..db import get_read_replica
+from ..exceptions import InvalidPaginationCursor, InvalidPaginationInput
+from .loaders import prime_loaders
+
+# Time-to-live (in seconds) of cached total counts of pages. Disable caching if zero
+TOTAL_COUNT_CACHE_TTL = int(os.getenv("TOTAL_COUNT_CACHE_TTL", 0))
+# If set, estimate total counts of pages instead of counting all matching rows
+TOTAL_COUNT_ESTIMATED = bool(os.getenv("TOTAL_COUNT_ESTIMATED", False))
 
-from ..exceptions import InvalidPaginationInput
+DEFAULT_PAGE_SIZE = 50
+
+total_count_cache = Cache(max_size=1024)
 
 
 class PageInfo:
@@ -52,11 +80,11 @@ class PageInfo:
 
 
 def pagination_parameters(pagination_input):
-    """Retrieve cursor and limit (default: Cursor() and 50, resp.) from the given
-    pagination input dictionary.
+    """Retrieve cursor and limit (default: Cursor() and `DEFAULT_PAGE_SIZE`, resp.)
+    from the given pagination input dictionary.
     The values of `after`/`first` take precedence over `before`/`last`.
     """
-    limit = 50
+    limit = DEFAULT_PAGE_SIZE
     if pagination_input is None:
         return Cursor(), limit
 
@@ -75,55 +103,118 @@ class Cursor:
 
     def __init__(self, value=None, forwards=True):
         """Decode and store value (a base64-encoded string).
-        The value serves as point to start a select query after/before (default: 0 for
-        forward pagination; not supported for backward pagination).
+        The value holds either an element ID, or a JSON-encoded pair of the value of the
+        element's sort field and its ID (see `Ordering.encode_cursor()`). It serves as
+        point to start a select query after/before (default: ID 0 for forward
+        pagination; not supported for backward pagination).
         Assume forward pagination by default.
+        Raise InvalidPaginationCursor if the value can't be decoded.
         """
         if value is None and not forwards:
             raise InvalidPaginationInput()
-        self.value = 0 if value is None else int(base64.b64decode(value))
         self.forwards = forwards
+        self.is_initial = value is None
+        self.id = 0
+        self.sort_value = None
+        self.has_sort_value = False
+        if value is None:
+            return
+
+        try:
+            decoded = base64.b64decode(value).decode()
+            if decoded.startswith("["):
+                self.sort_value, self.id = json.loads(decoded)
+                self.has_sort_value = True
+            else:
+                self.id = int(decoded)
+        except (ValueError, binascii.Error):
+            raise InvalidPaginationCursor()
+
+
+class Ordering:
+    """Order of the elements of a model: by the given sort field (ascending by default),
+    and by ID for elements with equal sort field values. Without sort field, order by ID
+    only.
+    Like MySQL does, NULL values of the sort field come first in ascending order, and
+    last in descending order.
+    """
 
-    def pagination_condition(self, model):
-        """Convert internal value into a condition that can be plugged into a
-        ModelSelect.where() clause for the given model.
+    def __init__(self, model, field=None, descending=False):
+        self.model = model
+        self.field = field
+        self.descending = descending
+
+    @classmethod
+    def from_input(cls, model, order_input):
+        """Create ordering from given input dictionary with 'field' (the name of a
+        model field) and 'direction' item. If no input given, order by ID.
+        """
+        if not order_input:
+            return cls(model)
+        return cls(
+            model,
+            getattr(model, order_input["field"]),
+            descending=order_input.get("direction") == "Descending",
+        )
+
+    def _is_descending(self, reverse):
+        return self.descending != reverse
+
+    def order_by(self, reverse=False):
+        """Return expressions for a ModelSelect.order_by() clause. Optionally reverse the
+        order (used for backward pagination).
         """
-        if self.forwards:
-            return model.id > self.value
-        return model.id < self.value
-
-    def has_next_previous_page(self, *conditions, elements, selection):
-        """For forward/backward pagination, determine whether a previous/next page
-        exists (i.e. if the model holds elements before the first / after the last one).
-        To this end, the given model selection is used (might contain joins required by
-        conditions).
-        Additional conditions, e.g. for filtering, are taken into account.
+        descending = self._is_descending(reverse)
+        columns = [self.model.id] if self.field is None else [self.field, self.model.id]
+        return [c.desc() if descending else c.asc() for c in columns]
+
+    def after_condition(self, cursor, reverse=False):
+        """Return a condition selecting all elements that come after the cursor in the
+        (optionally reversed) order.
+        Raise InvalidPaginationCursor if the ordering requires a sort field value but
+        the cursor does not hold one.
         """
-        model = selection.model
-        if self.forwards:
-            base_condition = model.id < elements[0].id
+        descending = self._is_descending(reverse)
+        id_after = (
+            self.model.id < cursor.id if descending else self.model.id > cursor.id
+        )
+        if self.field is None:
+            return id_after
+        if not cursor.has_sort_value:
+            raise InvalidPaginationCursor()
+
+        field, value = self.field, cursor.sort_value
+        if value is None:
+            condition = field.is_null() & id_after
+            return condition if descending else condition | field.is_null(False)
+
+        condition = (field < value if descending else field > value) | (
+            (field == value) & id_after
+        )
+        return condition | field.is_null() if descending else condition
+
+    def encode_cursor(self, element):
+        """Encode the element's ID (zero-padded to a byte-string of length 8) or, if a
+        sort field is set, the JSON-encoded pair of the element's sort field value and
+        its ID. Return the base64-encoded result as unicode string.
+        """
+        if self.field is None:
+            value = f"{element.id:08}"
         else:
-            base_condition = model.id > elements[-1].id
-
-        for condition in conditions:
-            base_condition = (base_condition) & (condition)
-        return selection.where(base_condition).get_or_none() is not None
-
-
-def _encode_id(element):
-    """Zero-pad the element's ID to a byte-string of length 8, and base64-encode it.
-    Return encoded result as unicode string.
-    """
-    return base64.b64encode(f"{element.id:08}".encode()).decode()
+            value = json.dumps(
+                [getattr(element, self.field.name), element.id], default=str
+            )
+        return base64.b64encode(value.encode()).decode()
 
 
-def _generate_page_info(*conditions, elements, cursor, limit, **kwargs):
+def _generate_page_info(*, elements, cursor, limit, ordering):
     """Generate pagination information from given elements and page limit. The elements
     comprise the current page and possibly the first element of the next/previous page.
     During forward/backward pagination, the following applies: If the number of elements
-    exceeds the limit, a next/previous page exists. Determining whether a previous/next
-    page exists is delegated to `Cursor.has_next_previous_page()`, passing `kwargs`.
-    Derive cursors from the page's last/first elements.
+    exceeds the limit, a next/previous page exists. Whether a previous/next page exists
+    is indicated by the `has_next_previous_page` attribute of the elements (see
+    `load_into_page()`); if absent, no such page exists.
+    Derive cursors from the page's last/first elements, according to the ordering.
     Return default PageInfo if no elements given (next/previous page cannot be
     determined efficiently even if existing). This is an edge case because it implies
     that the user e.g. ignored hasNextPage=False and requested the next page anyways.
@@ -132,52 +223,83 @@ def _generate_page_info(*conditions, elements, cursor, limit, **kwargs):
     if not elements:
         return info
 
-    has_next_previous_page = cursor.has_next_previous_page(
-        *conditions, elements=elements, **kwargs
-    )
+    encode = ordering.encode_cursor
+    has_next_previous_page = bool(getattr(elements[0], "has_next_previous_page", False))
     if cursor.forwards:
         info.has_previous_page = has_next_previous_page
-        info.start_cursor = _encode_id(elements[0])
+        info.start_cursor = encode(elements[0])
         if len(elements) > limit:
             info.has_next_page = True
-            info.end_cursor = _encode_id(elements[-2])
+            info.end_cursor = encode(elements[-2])
         else:
-            info.end_cursor = _encode_id(elements[-1])
+            info.end_cursor = encode(elements[-1])
 
     else:
         info.has_next_page = has_next_previous_page
-        info.end_cursor = _encode_id(elements[-1])
+        info.end_cursor = encode(elements[-1])
         if len(elements) > limit:
             info.has_previous_page = True
-            info.start_cursor = _encode_id(elements[1])
+            info.start_cursor = encode(elements[1])
         else:
-            info.start_cursor = _encode_id(elements[0])
+            info.start_cursor = encode(elements[0])
 
     return info
 
 
 def _compute_total_count(*conditions, selection):
-    """Compute total count, taking given conditions and model selection into account."""
+    """Compute total count, taking given conditions and model selection into account.
+    Depending on the configuration, the count is estimated, and/or cached. The cache key
+    is the SQL statement of the count query and its parameters; hence it accounts for
+    the model, filter conditions, and the base scope of the current user.
+    """
     base_condition = True
     for condition in conditions:
         base_condition = (base_condition) & (condition)
-    return selection.where(base_condition).count()
+    query = selection.where(base_condition)
 
+    count = _estimate_count if TOTAL_COUNT_ESTIMATED else _count
+    if not TOTAL_COUNT_CACHE_TTL:
+        return count(query)
 
-def generate_page(*conditions, elements, cursor, selection, **page_info_kwargs):
+    sql, params = query.sql()
+    return total_count_cache.get_or_set(
+        (sql, tuple(params)), lambda: count(query), ttl=TOTAL_COUNT_CACHE_TTL
+    )
+
+
+def _count(query):
+    return query.count()
+
+
+def _estimate_count(query):
+    """Estimate the number of rows returned by the query from the execution plan that
+    MySQL's EXPLAIN statement yields (based on the table statistics in
+    information_schema). This avoids scanning the filtered rows but might be off
+    considerably.
+    """
+    sql, params = query.sql()
+    database = get_read_replica() or query.model._meta.database
+    cursor = database.execute_sql(f"EXPLAIN {sql}", params)
+    columns = [c[0] for c in cursor.description]
+    estimate = 1
+    for row in cursor.fetchall():
+        plan = dict(zip(columns, row))
+        estimate *= (plan["rows"] or 0) * float(plan.get("filtered") or 100) / 100
+    return round(estimate)
+
+
+def generate_page(*conditions, elements, cursor, limit, selection, ordering):
     """Return a GraphQL Page type wrapping the given elements, and including appropriate
     page info.
     """
     page_info = _generate_page_info(
-        *conditions,
-        elements=elements,
-        cursor=cursor,
-        selection=selection,
-        **page_info_kwargs,
+        elements=elements, cursor=cursor, limit=limit, ordering=ordering
     )
     page = {
         "page_info": page_info,
-        "total_count": _compute_total_count(*conditions, selection=selection),
+        # Only computed if the totalCount field is requested. The default resolver calls
+        # the function, passing the GraphQL resolve info
+        "total_count": lambda _: _compute_total_count(*conditions, selection=selection),
     }
 
     if cursor.forwards:
@@ -188,25 +310,62 @@ def generate_page(*conditions, elements, cursor, selection, **page_info_kwargs):
     return page
 
 
-def load_into_page(model, *conditions, selection=None, pagination_input):
+def load_into_page(
+    model, *conditions, selection=None, pagination_input, order_input=None
+):
     """High-level convenience function to load result query of given model into a
     GraphQL page type.
     The query is constructed from the given selection (default: `model.select()`), and
-    optional conditions. The query results are ordered by model ID.
+    optional conditions. The query results are ordered according to the order input
+    (see `Ordering.from_input()`; default: by model ID). Elements are selected by
+    keyset pagination, i.e. by comparing sort field value and ID with the ones encoded
+    in the cursor. With appropriate database indexes, the cost of the query hence does
+    not depend on how deep the requested page is.
+    For backward pagination, the elements are selected in reverse order, and reversed
+    again afterwards.
+    If elements before/after the page might exist, the query is extended by a column
+    indicating their existence, such that no separate query is required.
+    The foreign keys of the page elements are registered with the corresponding loaders
+    such that related resources of all elements are fetched at once.
     """
     cursor, limit = pagination_parameters(pagination_input)
-    pagination_condition = cursor.pagination_condition(model)
+    ordering = Ordering.from_input(model, order_input)
+    reverse = not cursor.forwards
+
+    pagination_condition = (
+        True if cursor.is_initial else ordering.after_condition(cursor, reverse=reverse)
+    )
     for condition in conditions:
         pagination_condition = (condition) & (pagination_condition)
 
-    selection = selection or model.select()
+    if selection is None:
+        selection = model.select()
     query_result = (
-        selection.where(pagination_condition).order_by(model.id).limit(limit + 1)
+        selection.where(pagination_condition)
+        .order_by(*ordering.order_by(reverse=reverse))
+        .limit(limit + 1)
     )
+
+    if not cursor.is_initial:
+        # Elements at the cursor or before/after it (forward/backward pagination)
+        other_page_condition = ordering.after_condition(cursor, reverse=not reverse) | (
+            model.id == cursor.id
+        )
+        for condition in conditions:
+            other_page_condition = (other_page_condition) & (condition)
+        other_page_query = selection.select(SQL("1")).where(other_page_condition)
+        query_result = query_result.select_extend(
+            fn.EXISTS(other_page_query).alias("has_next_previous_page")
+        )
+
+    elements = prime_loaders(query_result)
+    if reverse:
+        elements.reverse()
     return generate_page(
         *conditions,
-        elements=query_result,
+        elements=elements,
         cursor=cursor,
         limit=limit,
         selection=selection,
+        ordering=ordering,
     )
@@ -1,9 +1,12 @@
 """GraphQL resolver functionality"""
+import threading
 from datetime import date
 
 from ariadne import MutationType, ObjectType, QueryType, convert_kwargs_to_snake_case
+from ariadne.utils import convert_camel_case_to_snake
 from flask import g
-from peewee import fn
+from graphql import FragmentSpreadNode, InlineFragmentNode, get_named_type
+from graphql.execution.values import get_argument_values
 
 from ..authz import (
     agreement_organisation_filter_condition,
@@ -27,9 +30,12 @@ from ..enums import HumanGender, TransferAgreementType
 from ..models.crud import (
     create_beneficiary,
     create_box,
+    create_boxes,
     create_qr_code,
+    create_qr_codes,
     update_beneficiary,
     update_box,
+    update_boxes,
 )
 from ..models.definitions.base import Base
 from ..models.definitions.beneficiary import Beneficiary
@@ -45,15 +51,20 @@ from ..models.definitions.size import Size
 from ..models.definitions.transaction import Transaction
 from ..models.definitions.transfer_agreement import TransferAgreement
 from ..models.definitions.user import User
-from ..models.definitions.x_beneficiary_language import XBeneficiaryLanguage
 from ..models.metrics import (
+    TRANSACTION_METRICS,
     compute_moved_stock_overview,
-    compute_number_of_beneficiaries_served,
-    compute_number_of_families_served,
-    compute_number_of_sales,
     compute_stock_overview,
+    compute_transaction_metrics,
 )
 from .filtering import derive_beneficiary_filter, derive_box_filter
+from .loaders import (
+    BeneficiaryLanguagesLoader,
+    BeneficiaryTokensLoader,
+    get_loader,
+    load_related,
+    prime_loaders,
+)
 from .pagination import load_into_page
 
 query = QueryType()
@@ -131,13 +142,15 @@ def resolve_qr_exists(*_, qr_code):
 @convert_kwargs_to_snake_case
 def resolve_qr_code(obj, _, qr_code=None):
     authorize(permission="qr:read")
-    return obj.qr_code if qr_code is None else QrCode.get(QrCode.code == qr_code)
+    if qr_code is None:
+        return load_related(obj, "qr_code")
+    return QrCode.get_by_code(qr_code)
 
 
 @query.field("product")
 @box.field("product")
 def resolve_product(obj, _, id=None):
-    product = obj.product if id is None else Product.get_by_id(id)
+    product = load_related(obj, "product") if id is None else Product.get_by_id(id)
     authorize(permission="product:read", base_id=product.base_id)
     return product
 
@@ -158,7 +171,7 @@ def resolve_box(*_, label_identifier):
 @query.field("location")
 @box.field("location")
 def resolve_location(obj, _, id=None):
-    location = obj.location if id is None else Location.get_by_id(id)
+    location = load_related(obj, "location") if id is None else Location.get_by_id(id)
     authorize(permission="location:read", base_id=location.base_id)
     return location
 
@@ -200,7 +213,9 @@ def resolve_organisations(*_):
 @query.field("locations")
 def resolve_locations(*_):
     authorize(permission="location:read")
-    return Location.select().join(Base).where(base_filter_condition("location:read"))
+    return prime_loaders(
+        Location.select().join(Base).where(base_filter_condition("location:read"))
+    )
 
 
 @query.field("products")
@@ -217,7 +232,7 @@ def resolve_products(*_, pagination_input=None):
 
 @query.field("beneficiaries")
 @convert_kwargs_to_snake_case
-def resolve_beneficiaries(*_, pagination_input=None, filter_input=None):
+def resolve_beneficiaries(*_, pagination_input=None, filter_input=None, order_by=None):
     authorize(permission="beneficiary:read")
     filter_condition = derive_beneficiary_filter(filter_input)
     return load_into_page(
@@ -225,6 +240,7 @@ def resolve_beneficiaries(*_, pagination_input=None, filter_input=None):
         base_filter_condition("beneficiary:read") & filter_condition,
         selection=Beneficiary.select().join(Base),
         pagination_input=pagination_input,
+        order_input=order_by,
     )
 
 
@@ -241,7 +257,7 @@ def resolve_transfer_agreements(*_, states=None):
 @query.field("shipments")
 def resolve_shipments(*_):
     authorize(permission="shipment:read")
-    return (
+    return prime_loaders(
         Shipment.select()
         .join(TransferAgreement)
         .where(agreement_organisation_filter_condition())
@@ -250,27 +266,77 @@ def resolve_shipments(*_):
 
 @query.field("metrics")
 @convert_kwargs_to_snake_case
-def resolve_metrics(*_, organisation_id=None):
+def resolve_metrics(_, info, organisation_id=None):
     # Default to current user's organisation ID
     organisation_id = organisation_id or g.user.organisation_id
     # Non-god users are only permitted to fetch their organisation's metrics, the god
     # user however can access any organisation's metrics
     authorize(organisation_id=organisation_id)
 
-    # Pass organisation ID to child resolvers
-    return {"organisation_id": organisation_id}
+    # Pass organisation ID, selected transaction metrics, and storage for their values
+    # to child resolvers
+    return {
+        "organisation_id": organisation_id,
+        "selected_transaction_metrics": _selected_transaction_metrics(info),
+        "transaction_metrics": {},
+        # Guards the computation of transaction metrics by concurrent resolvers
+        "lock": threading.Lock(),
+    }
+
+
+def _selected_transaction_metrics(info):
+    """Return a mapping of date ranges (pairs of `after` and `before` arguments) to the
+    names of transaction metrics (see `TRANSACTION_METRICS`) that are selected for the
+    date range in the query.
+    """
+    metrics_type = get_named_type(info.return_type)
+    selected = {}
+
+    def collect(selection_set):
+        for selection in selection_set.selections:
+            if isinstance(selection, FragmentSpreadNode):
+                collect(info.fragments[selection.name.value].selection_set)
+            elif isinstance(selection, InlineFragmentNode):
+                collect(selection.selection_set)
+            else:
+                name = convert_camel_case_to_snake(selection.name.value)
+                if name not in TRANSACTION_METRICS:
+                    continue
+                arguments = get_argument_values(
+                    metrics_type.fields[selection.name.value],
+                    selection,
+                    info.variable_values,
+                )
+                date_range = (arguments.get("after"), arguments.get("before"))
+                selected.setdefault(date_range, set()).add(name)
+
+    for field_node in info.field_nodes:
+        collect(field_node.selection_set)
+    return selected
+
+
+def _resolve_transaction_metric(metrics_obj, name, after, before):
+    """Return value of the transaction metric with given name in the date range. On
+    first access, compute all metrics selected for the date range at once.
+    """
+    date_range = (after, before)
+    values = metrics_obj["transaction_metrics"]
+    with metrics_obj["lock"]:
+        if date_range not in values:
+            names = metrics_obj["selected_transaction_metrics"].get(date_range, {name})
+            values[date_range] = compute_transaction_metrics(
+                organisation_id=metrics_obj["organisation_id"],
+                after=after,
+                before=before,
+                names=sorted(names),
+            )
+    return values[date_range][name]
 
 
 @beneficiary.field("tokens")
 def resolve_beneficiary_tokens(beneficiary_obj, _):
     authorize(permission="transaction:read")
-    # If the beneficiary has no transactions yet, the select query returns None
-    return (
-        Transaction.select(fn.sum(Transaction.tokens))
-        .where(Transaction.beneficiary == beneficiary_obj.id)
-        .scalar()
-        or 0
-    )
+    return get_loader(BeneficiaryTokensLoader).load(beneficiary_obj.id)
 
 
 @beneficiary.field("transactions")
@@ -286,12 +352,7 @@ def resolve_beneficiary_registered(beneficiary_obj, _):
 
 @beneficiary.field("languages")
 def resolve_beneficiary_languages(beneficiary_obj, _):
-    return [
-        x.language.id
-        for x in XBeneficiaryLanguage.select().where(
-            XBeneficiaryLanguage.beneficiary == beneficiary_obj.id
-        )
-    ]
+    return get_loader(BeneficiaryLanguagesLoader).load(beneficiary_obj.id)
 
 
 @beneficiary.field("gender")
@@ -336,6 +397,12 @@ def resolve_create_qr_code(*_, box_label_identifier=None):
     return create_qr_code(box_label_identifier=box_label_identifier)
 
 
+@mutation.field("createQrCodes")
+def resolve_create_qr_codes(*_, count):
+    authorize(permission="qr:create")
+    return create_qr_codes(count)
+
+
 @mutation.field("createBox")
 @convert_kwargs_to_snake_case
 def resolve_create_box(*_, creation_input):
@@ -343,6 +410,15 @@ def resolve_create_box(*_, creation_input):
     return create_box(user_id=g.user.id, **creation_input)
 
 
+@mutation.field("createBoxes")
+@convert_kwargs_to_snake_case
+def resolve_create_boxes(*_, creation_inputs):
+    authorize(permission="stock:write")
+    return prime_loaders(
+        create_boxes(user_id=g.user.id, creation_inputs=creation_inputs)
+    )
+
+
 @mutation.field("updateBox")
 @convert_kwargs_to_snake_case
 def resolve_update_box(*_, update_input):
@@ -350,6 +426,15 @@ def resolve_update_box(*_, update_input):
     return update_box(user_id=g.user.id, **update_input)
 
 
+@mutation.field("updateBoxes")
+@convert_kwargs_to_snake_case
+def resolve_update_boxes(*_, update_input):
+    authorize(permission="stock:write")
+    result = update_boxes(user_id=g.user.id, **update_input)
+    prime_loaders(result["updated_boxes"])
+    return result
+
+
 @mutation.field("createBeneficiary")
 @convert_kwargs_to_snake_case
 def resolve_create_beneficiary(*_, creation_input):
@@ -467,23 +552,30 @@ def resolve_send_shipment(*_, id):
 @base.field("locations")
 def resolve_base_locations(base_obj, _):
     authorize(permission="location:read")
-    return Location.select().where(Location.base == base_obj.id)
+    return prime_loaders(Location.select().where(Location.base == base_obj.id))
 
 
 @base.field("beneficiaries")
 @convert_kwargs_to_snake_case
-def resolve_base_beneficiaries(base_obj, _, pagination_input=None, filter_input=None):
+def resolve_base_beneficiaries(
+    base_obj, _, pagination_input=None, filter_input=None, order_by=None
+):
     authorize(permission="beneficiary:read")
     base_filter_condition = Beneficiary.base == base_obj.id
     filter_condition = base_filter_condition & derive_beneficiary_filter(filter_input)
     return load_into_page(
-        Beneficiary, filter_condition, pagination_input=pagination_input
+        Beneficiary,
+        filter_condition,
+        pagination_input=pagination_input,
+        order_input=order_by,
     )
 
 
 @location.field("boxes")
 @convert_kwargs_to_snake_case
-def resolve_location_boxes(location_obj, _, pagination_input=None, filter_input=None):
+def resolve_location_boxes(
+    location_obj, _, pagination_input=None, filter_input=None, order_by=None
+):
     authorize(permission="stock:read")
     location_filter_condition = Box.location == location_obj.id
     filter_condition = location_filter_condition & derive_box_filter(filter_input)
@@ -493,14 +585,18 @@ def resolve_location_boxes(location_obj, _, pagination_input=None, filter_input=
     ):
         selection = Box.select().join(Product)
     return load_into_page(
-        Box, filter_condition, selection=selection, pagination_input=pagination_input
+        Box,
+        filter_condition,
+        selection=selection,
+        pagination_input=pagination_input,
+        order_input=order_by,
     )
 
 
 @metrics.field("numberOfFamiliesServed")
 def resolve_metrics_number_of_families_served(metrics_obj, _, after=None, before=None):
-    return compute_number_of_families_served(
-        organisation_id=metrics_obj["organisation_id"], after=after, before=before
+    return _resolve_transaction_metric(
+        metrics_obj, "number_of_families_served", after, before
     )
 
 
@@ -508,16 +604,14 @@ def resolve_metrics_number_of_families_served(metrics_obj, _, after=None, before
 def resolve_metrics_number_of_beneficiaries_served(
     metrics_obj, _, after=None, before=None
 ):
-    return compute_number_of_beneficiaries_served(
-        organisation_id=metrics_obj["organisation_id"], after=after, before=before
+    return _resolve_transaction_metric(
+        metrics_obj, "number_of_beneficiaries_served", after, before
     )
 
 
 @metrics.field("numberOfSales")
 def resolve_metrics_number_of_sales(metrics_obj, _, after=None, before=None):
-    return compute_number_of_sales(
-        organisation_id=metrics_obj["organisation_id"], after=after, before=before
-    )
+    return _resolve_transaction_metric(metrics_obj, "number_of_sales", after, before)
 
 
 @metrics.field("stockOverview")
@@ -543,7 +637,7 @@ def resolve_organisation_bases(organisation_obj, _):
 @product.field("base")
 def resolve_resource_base(obj, _):
     authorize(permission="base:read")
-    return obj.base
+    return load_related(obj, "base")
 
 
 @product.field("gender")
@@ -583,46 +677,48 @@ def resolve_qr_code_box(qr_code_obj, _):
 
 @shipment.field("details")
 def resolve_shipment_details(shipment_obj, _):
-    return ShipmentDetail.select().where(
-        (ShipmentDetail.shipment == shipment_obj.id)
-        & (ShipmentDetail.deleted_on.is_null())
+    return prime_loaders(
+        ShipmentDetail.select().where(
+            (ShipmentDetail.shipment == shipment_obj.id)
+            & (ShipmentDetail.deleted_on.is_null())
+        )
     )
 
 
 @shipment.field("sourceBase")
 def resolve_shipment_source_base(shipment_obj, _):
     authorize(permission="base:read")
-    return shipment_obj.source_base
+    return load_related(shipment_obj, "source_base")
 
 
 @shipment.field("targetBase")
 def resolve_shipment_target_base(shipment_obj, _):
     authorize(permission="base:read")
-    return shipment_obj.target_base
+    return load_related(shipment_obj, "target_base")
 
 
 @shipment_detail.field("sourceProduct")
 def resolve_shipment_detail_source_product(detail_obj, _):
     authorize(permission="product:read")
-    return detail_obj.source_product
+    return load_related(detail_obj, "source_product")
 
 
 @shipment_detail.field("targetProduct")
 def resolve_shipment_detail_target_product(detail_obj, _):
     authorize(permission="product:read")
-    return detail_obj.target_product
+    return load_related(detail_obj, "target_product")
 
 
 @shipment_detail.field("sourceLocation")
 def resolve_shipment_detail_source_location(detail_obj, _):
     authorize(permission="location:read")
-    return detail_obj.source_location
+    return load_related(detail_obj, "source_location")
 
 
 @shipment_detail.field("targetLocation")
 def resolve_shipment_detail_target_location(detail_obj, _):
     authorize(permission="location:read")
-    return detail_obj.target_location
+    return load_related(detail_obj, "target_location")
 
 
 @transfer_agreement.field("sourceBases")
@@ -644,11 +740,13 @@ def resolve_transfer_agreement_target_bases(transfer_agreement_obj, _):
 @transfer_agreement.field("shipments")
 def resolve_transfer_agreement_shipments(transfer_agreement_obj, _):
     authorize(permission="shipment:read")
-    return Shipment.select().where(
-        Shipment.transfer_agreement == transfer_agreement_obj.id
+    return prime_loaders(
+        Shipment.select().where(
+            Shipment.transfer_agreement == transfer_agreement_obj.id
+        )
     )
 
 
 @user.field("organisation")
 def resolve_user_organisation(*_):
-    return Organisation.get_by_id(g.user.organisation_id)
+    return get_loader(Organisation).load(g.user.organisation_id)
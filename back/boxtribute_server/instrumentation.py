@@ -0,0 +1,337 @@
+"""Instrumentation of GraphQL request handling: timing of resolvers, and counting of
+SQL queries.
+
+If enabled, the `TracingExtension` records for every resolved field (skipping fields
+with default resolvers) its wall time, and the number and duration of the SQL queries
+executed while resolving it. The records are returned in Apollo-tracing format in the
+`extensions.tracing` field of the response, and aggregated into process-wide metrics
+which are exposed in Prometheus text format.
+
+In development and test mode, the `QueryMonitorExtension` logs slow SQL queries, and
+suspected N+1 query patterns.
+"""
+import re
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from time import perf_counter_ns
+
+from ariadne.contrib.tracing.apollotracing import ApolloTracingExtensionSync
+from ariadne.contrib.tracing.utils import format_path, should_trace
+from ariadne.types import Extension
+from flask import current_app, g, has_app_context
+
+NS_IN_SECOND = 1e9
+# Upper bounds (in seconds) of histogram buckets
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Upper bounds of buckets for numbers of SQL queries per request
+SQL_QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# Duration (in ns) above which SQL queries are logged as slow by the query monitor
+SLOW_QUERY_THRESHOLD = 100_000_000
+# Number of queries of identical shape within a request above which the query monitor
+# reports a suspected N+1 pattern
+N_PLUS_ONE_THRESHOLD = 5
+
+# Lists of SQL statements that are currently captured (see `capture_sql_queries()`)
+_captures = []
+
+
+class Histogram:
+    """Distribution of observed values over buckets with given upper bounds (as in
+    Prometheus, bucket counts are cumulative when rendered).
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        index = next(
+            (i for i, bound in enumerate(self.buckets) if value <= bound),
+            len(self.buckets),
+        )
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels=""):
+        lines = []
+        cumulative = 0
+        bounds = [str(b) for b in self.buckets] + ["+Inf"]
+        for bound, count in zip(bounds, self.counts):
+            cumulative += count
+            label = f'{labels},le="{bound}"' if labels else f'le="{bound}"'
+            lines.append(f"{name}_bucket{{{label}}} {cumulative}")
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Thread-safe, process-wide aggregation of request and resolver metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.request_durations = Histogram(DURATION_BUCKETS)
+            self.request_sql_queries = Histogram(SQL_QUERY_BUCKETS)
+            # Mappings of field names (`Type.field`) to histograms, resp. totals
+            self.field_durations = {}
+            self.field_sql_queries = {}
+            self.field_sql_durations = {}
+
+    def observe_request(self, *, duration, sql_queries, resolvers):
+        """Aggregate the request's duration (in seconds), its number of SQL queries, and
+        the resolver records of the `TracingExtension`.
+        """
+        with self._lock:
+            self.request_durations.observe(duration)
+            self.request_sql_queries.observe(sql_queries)
+            for record in resolvers:
+                field = f"{record['parentType']}.{record['fieldName']}"
+                if field not in self.field_durations:
+                    self.field_durations[field] = Histogram(DURATION_BUCKETS)
+                # Records of resolvers that haven't completed lack some entries
+                duration = record.get("duration", 0) / NS_IN_SECOND
+                sql_queries = record.get("sqlQueries", 0)
+                sql_duration = record.get("sqlDuration", 0) / NS_IN_SECOND
+                self.field_durations[field].observe(duration)
+                self.field_sql_queries[field] = (
+                    self.field_sql_queries.get(field, 0) + sql_queries
+                )
+                self.field_sql_durations[field] = (
+                    self.field_sql_durations.get(field, 0) + sql_duration
+                )
+
+    def render(self, caches=None, pool_statistics=None):
+        """Return metrics in Prometheus text format. Optionally include hit and miss
+        counts of the given caches (a mapping of names to `cache.Cache` instances), and
+        statistics of the database connection pool (see
+        `db.InstrumentedPooledMySQLDatabase.pool_statistics()`).
+        """
+        with self._lock:
+            lines = [
+                "# TYPE graphql_request_duration_seconds histogram",
+                *self.request_durations.render("graphql_request_duration_seconds"),
+                "# TYPE graphql_request_sql_queries histogram",
+                *self.request_sql_queries.render("graphql_request_sql_queries"),
+                "# TYPE graphql_field_duration_seconds histogram",
+            ]
+            for field, histogram in sorted(self.field_durations.items()):
+                lines.extend(
+                    histogram.render(
+                        "graphql_field_duration_seconds", f'field="{field}"'
+                    )
+                )
+            lines.append("# TYPE graphql_field_sql_queries_total counter")
+            for field, count in sorted(self.field_sql_queries.items()):
+                lines.append(
+                    f'graphql_field_sql_queries_total{{field="{field}"}} {count}'
+                )
+            lines.append("# TYPE graphql_field_sql_duration_seconds_total counter")
+            for field, duration in sorted(self.field_sql_durations.items()):
+                lines.append(
+                    f'graphql_field_sql_duration_seconds_total{{field="{field}"}} '
+                    f"{duration}"
+                )
+
+        for kind in ["hits", "misses"]:
+            lines.append(f"# TYPE cache_{kind}_total counter")
+            for name, cache in sorted((caches or {}).items()):
+                value = getattr(cache, kind)
+                lines.append(f'cache_{kind}_total{{cache="{name}"}} {value}')
+
+        if pool_statistics is not None:
+            lines.append("# TYPE db_pool_connections gauge")
+            for state in ["in_use", "idle"]:
+                value = pool_statistics[state]
+                lines.append(f'db_pool_connections{{state="{state}"}} {value}')
+            lines.extend(
+                [
+                    "# TYPE db_pool_max_connections gauge",
+                    f"db_pool_max_connections {pool_statistics['max']}",
+                    "# TYPE db_pool_waits_total counter",
+                    f"db_pool_waits_total {pool_statistics['waits']}",
+                ]
+            )
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+
+class TracingExtension(ApolloTracingExtensionSync):
+    """Extension of the Apollo tracing records by the number (`sqlQueries`) and duration
+    (`sqlDuration`, in ns) of SQL queries executed while resolving the field. Queries
+    executed outside of any traced resolver are only counted for the request.
+    On request completion, records are aggregated into the metrics registry.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.sql_queries = 0
+        self._lock = threading.Lock()
+        # Records of the fields that are currently resolved by the respective thread
+        # (see `execution.execute_graphql_async()` for concurrent resolving)
+        self._local = threading.local()
+
+    def request_started(self, context):
+        super().request_started(context)
+        g.tracing = self
+
+    def request_finished(self, context):
+        g.pop("tracing", None)
+        totals = self.get_totals()
+        metrics_registry.observe_request(
+            duration=totals["duration"] / NS_IN_SECOND,
+            sql_queries=self.sql_queries,
+            resolvers=totals["resolvers"],
+        )
+
+    def _active_records(self):
+        return self._local.__dict__.setdefault("records", [])
+
+    def resolve(self, next_, parent, info, **kwargs):
+        if not should_trace(info):
+            return next_(parent, info, **kwargs)
+
+        # Like the parent class's method but the record is complete when it's appended
+        start_timestamp = perf_counter_ns()
+        record = {
+            "path": format_path(info.path),
+            "parentType": str(info.parent_type),
+            "fieldName": info.field_name,
+            "returnType": str(info.return_type),
+            "startOffset": start_timestamp - self.start_timestamp,
+            "sqlQueries": 0,
+            "sqlDuration": 0,
+        }
+        with self._lock:
+            self.resolvers.append(record)
+        active_records = self._active_records()
+        active_records.append(record)
+        try:
+            return next_(parent, info, **kwargs)
+        finally:
+            active_records.pop()
+            record["duration"] = perf_counter_ns() - start_timestamp
+
+    def record_sql(self, sql, duration):
+        with self._lock:
+            self.sql_queries += 1
+        active_records = self._active_records()
+        if active_records:
+            record = active_records[-1]
+            record["sqlQueries"] += 1
+            record["sqlDuration"] += duration
+
+
+def normalize_sql(sql):
+    """Return the shape of the SQL statement, i.e. with collapsed whitespace, and with
+    lists of parameter placeholders (e.g. in `IN (%s, %s)`) reduced to one.
+    """
+    sql = re.sub(r"\s+", " ", sql).strip()
+    return re.sub(r"(%s|\?)(, (%s|\?))+", r"\1", sql)
+
+
+class QueryMonitorExtension(Extension):
+    """Development aid monitoring the SQL queries of a GraphQL request.
+    - Queries slower than `SLOW_QUERY_THRESHOLD` are logged with the path of the field
+      being resolved.
+    - On request completion, queries are grouped by shape (see `normalize_sql()`).
+      Shapes executed more than `N_PLUS_ONE_THRESHOLD` times are logged as suspected
+      N+1 patterns, e.g. when a resolver fetches related resources per element of a
+      list instead of using a loader.
+    """
+
+    def __init__(self):
+        self.paths_by_shape = defaultdict(list)
+        self._lock = threading.Lock()
+        # Paths of the fields that are currently resolved by the respective thread
+        # (see `execution.execute_graphql_async()` for concurrent resolving)
+        self._local = threading.local()
+
+    def request_started(self, context):
+        g.query_monitor = self
+
+    def request_finished(self, context):
+        g.pop("query_monitor", None)
+        for shape, paths in self.paths_by_shape.items():
+            if len(paths) > N_PLUS_ONE_THRESHOLD:
+                current_app.logger.warning(
+                    "Suspected N+1 pattern: %d queries of shape '%s' at %s",
+                    len(paths),
+                    shape,
+                    ", ".join(sorted(set(paths), key=paths.index)),
+                )
+
+    def _active_paths(self):
+        return self._local.__dict__.setdefault("paths", [])
+
+    def resolve(self, next_, parent, info, **kwargs):
+        active_paths = self._active_paths()
+        active_paths.append(info.path)
+        try:
+            return next_(parent, info, **kwargs)
+        finally:
+            active_paths.pop()
+
+    def record_sql(self, sql, duration):
+        path = "-"
+        active_paths = self._active_paths()
+        if active_paths:
+            path = ".".join(str(p) for p in format_path(active_paths[-1]))
+        if duration > SLOW_QUERY_THRESHOLD:
+            current_app.logger.warning(
+                "Slow SQL query (%.1f ms) at %s: %s", duration / 1e6, path, sql
+            )
+        shape = normalize_sql(sql)
+        with self._lock:
+            self.paths_by_shape[shape].append(path)
+
+
+@contextmanager
+def capture_sql_queries():
+    """Context manager yielding a list that collects all SQL statements executed within
+    the context.
+    """
+    statements = []
+    _captures.append(statements)
+    try:
+        yield statements
+    finally:
+        _captures.remove(statements)
+
+
+def record_sql(sql, duration):
+    """Record an SQL query of given duration (in ns) for captures, and for the tracing
+    and query monitor of the current request, if any.
+    """
+    for statements in _captures:
+        statements.append(sql)
+
+    if not has_app_context():
+        return
+    for name in ["tracing", "query_monitor"]:
+        recorder = g.get(name)
+        if recorder is not None:
+            recorder.record_sql(sql, duration)
+
+
+class SqlTimingMixin:
+    """Mixin for peewee database classes to report executed SQL queries (see
+    `record_sql()`).
+    """
+
+    def execute_sql(self, sql, *args, **kwargs):
+        start = perf_counter_ns()
+        try:
+            return super().execute_sql(sql, *args, **kwargs)
+        finally:
+            record_sql(sql, perf_counter_ns() - start)
@@ -15,4 +15,14 @@ configure_app(
     password=os.environ["MYSQL_PASSWORD"],
     database=os.environ["MYSQL_DB"],
     unix_socket=os.getenv("MYSQL_SOCKET"),
+    pool_max_connections=(
+        int(os.environ["MYSQL_POOL_MAX_CONNECTIONS"])
+        if os.getenv("MYSQL_POOL_MAX_CONNECTIONS")
+        else None
+    ),
+    pool_stale_timeout=int(os.getenv("MYSQL_POOL_STALE_TIMEOUT", 300)),
+    pool_timeout=int(os.getenv("MYSQL_POOL_TIMEOUT", 10)),
+    replica_hosts=[h for h in os.getenv("MYSQL_REPLICA_HOSTS", "").split(",") if h],
+    secret_key=os.getenv("SECRET_KEY"),
+    monitor_sql_queries=os.getenv("FLASK_ENV") == "development",
 )
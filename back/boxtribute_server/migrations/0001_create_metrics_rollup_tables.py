@@ -0,0 +1,25 @@
+"""
+create_metrics_rollup_tables
+date created: 2022-05-02 10:12:41.219583
+
+After applying, populate the tables by `flask refresh-metrics --full`
+"""
+from boxtribute_server.models.definitions.daily_sales import DailySales
+from boxtribute_server.models.definitions.daily_served_beneficiary import (
+    DailyServedBeneficiary,
+)
+from boxtribute_server.models.definitions.metrics_rollup_watermark import (
+    MetricsRollupWatermark,
+)
+
+MODELS = [DailySales, DailyServedBeneficiary, MetricsRollupWatermark]
+
+
+def upgrade(migrator):
+    with migrator.database.bind_ctx(MODELS):
+        migrator.database.create_tables(MODELS)
+
+
+def downgrade(migrator):
+    with migrator.database.bind_ctx(MODELS):
+        migrator.database.drop_tables(MODELS)
@@ -0,0 +1,28 @@
+"""
+add_keyset_pagination_indexes
+date created: 2022-05-09 14:03:27.512904
+
+Add the composite indexes declared in the Meta classes of the Box and Beneficiary
+models. The index names match the ones peewee generates when creating the tables.
+"""
+INDEXES = [
+    ("stock", "box_location_id_box_id", ("location_id", "box_id")),
+    ("stock", "box_location_id_modified", ("location_id", "modified")),
+    ("people", "beneficiary_camp_id_firstname", ("camp_id", "firstname")),
+    ("people", "beneficiary_camp_id_lastname", ("camp_id", "lastname")),
+    ("people", "beneficiary_camp_id_container", ("camp_id", "container")),
+    ("people", "beneficiary_camp_id_created", ("camp_id", "created")),
+]
+
+
+def upgrade(migrator):
+    for table, name, columns in INDEXES:
+        cursor = migrator.execute_sql(
+            f"CREATE INDEX {name} ON {table} ({', '.join(columns)});"
+        )
+        cursor.close()
+
+
+def downgrade(migrator):
+    for table, name, _ in reversed(INDEXES):
+        migrator.drop_index(table, name)
@@ -0,0 +1,21 @@
+"""
+add_beneficiary_fulltext_index
+date created: 2022-05-09 14:21:08.094117
+
+Add the full-text index used for searching beneficiaries by pattern (see
+graph_ql.filtering.derive_beneficiary_filter). The index definition matches the one
+declared on the Beneficiary model.
+"""
+TABLE = "people"
+INDEX = "people_fulltext_search"
+
+
+def upgrade(migrator):
+    cursor = migrator.execute_sql(
+        f"CREATE FULLTEXT INDEX {INDEX} ON {TABLE} (firstname, lastname, comments);"
+    )
+    cursor.close()
+
+
+def downgrade(migrator):
+    migrator.drop_index(TABLE, INDEX)
@@ -1,12 +1,13 @@
 """Create-Retrieve-Update-Delete operations on database models."""
 import hashlib
 import random
+import uuid
 
 import peewee
 
 from ..db import db
 from ..enums import BoxState
-from ..exceptions import BoxCreationFailed
+from ..exceptions import BoxCreationFailed, InvalidBoxCount, InvalidQrCodeCount
 from .definitions.beneficiary import Beneficiary
 from .definitions.box import Box
 from .definitions.location import Location
@@ -15,6 +16,12 @@ from .definitions.x_beneficiary_language import XBeneficiaryLanguage
 from .utils import utcnow
 
 BOX_LABEL_IDENTIFIER_GENERATION_ATTEMPTS = 10
+# Maximum number of boxes created by a single call of `create_boxes()`
+MAX_BOXES_PER_REQUEST = 500
+# Maximum number of QR codes created by a single call of `create_qr_codes()`
+MAX_QR_CODES_PER_REQUEST = 5000
+# Number of rows per INSERT statement when creating QR codes in bulk
+QR_CODE_INSERT_BATCH_SIZE = 500
 
 
 def create_box(
@@ -65,6 +72,111 @@ def create_box(
     raise BoxCreationFailed()
 
 
+def _generate_label_identifiers(count):
+    """Return a list of `count` distinct 8-digit sequences that are not used as label
+    identifiers of existing boxes. Candidates are checked against the database in a
+    single query per attempt; only colliding ones are re-generated. If not enough
+    unique sequences are found after several attempts, raise a BoxCreationFailed
+    exception.
+    """
+    identifiers = set()
+    for i in range(BOX_LABEL_IDENTIFIER_GENERATION_ATTEMPTS):
+        candidates = {
+            "".join(random.choices("0123456789", k=8))
+            for _ in range(count - len(identifiers))
+        } - identifiers
+        existing = Box.select(Box.label_identifier).where(
+            Box.label_identifier << list(candidates)
+        )
+        identifiers |= candidates - {box.label_identifier for box in existing}
+        if len(identifiers) == count:
+            return list(identifiers)
+    raise BoxCreationFailed()
+
+
+def create_boxes(*, user_id, creation_inputs):
+    """Insert information for several new boxes in the database at once. Every input is
+    a dictionary of the arguments of `create_box()` (except `user_id`), and the boxes
+    are set up the same way.
+    Locations and QR codes are validated with one query each; raise a DoesNotExist
+    exception if any does not exist. Label identifiers are generated for all boxes
+    at once (see `_generate_label_identifiers()`), and the boxes are inserted in a
+    single query. If a concurrent request inserted a box with one of the identifiers
+    in the meantime, repeat the generation.
+    Return the new boxes in the order of the inputs. Raise InvalidBoxCount if the
+    number of inputs exceeds `MAX_BOXES_PER_REQUEST`.
+    """
+    if not creation_inputs:
+        return []
+    if len(creation_inputs) > MAX_BOXES_PER_REQUEST:
+        raise InvalidBoxCount(maximum=MAX_BOXES_PER_REQUEST)
+
+    location_ids = {i["location_id"] for i in creation_inputs}
+    location_box_states = dict(
+        Location.select(Location.id, Location.box_state)
+        .where(Location.id << list(location_ids))
+        .tuples()
+    )
+    if location_ids - location_box_states.keys():
+        raise Location.DoesNotExist()
+
+    codes = {i["qr_code"] for i in creation_inputs if i.get("qr_code") is not None}
+    qr_ids = {}
+    if codes:
+        qr_ids = dict(
+            QrCode.select(QrCode.code, QrCode.id)
+            .where(QrCode.code << list(codes))
+            .tuples()
+        )
+        if codes - qr_ids.keys():
+            raise QrCode.DoesNotExist()
+
+    now = utcnow()
+    rows = []
+    for creation_input in creation_inputs:
+        location_box_state_id = location_box_states[creation_input["location_id"]]
+        qr_code = creation_input.get("qr_code")
+        rows.append(
+            {
+                "comment": creation_input.get("comment", ""),
+                "created_on": now,
+                "created_by": user_id,
+                "items": creation_input.get("items", 0),
+                "last_modified_on": now,
+                "last_modified_by": user_id,
+                "location": creation_input["location_id"],
+                "product": creation_input["product_id"],
+                "size": creation_input["size_id"],
+                "state": BoxState.InStock
+                if location_box_state_id is None
+                else location_box_state_id,
+                "qr_code": None if qr_code is None else qr_ids[qr_code],
+            }
+        )
+
+    for i in range(BOX_LABEL_IDENTIFIER_GENERATION_ATTEMPTS):
+        identifiers = _generate_label_identifiers(len(rows))
+        try:
+            with db.database.atomic():
+                Box.insert_many(
+                    [
+                        {**row, "label_identifier": identifier}
+                        for row, identifier in zip(rows, identifiers)
+                    ]
+                ).execute()
+        except peewee.IntegrityError as e:
+            if "Duplicate entry" not in str(e):
+                raise
+            continue
+
+        boxes = {
+            box.label_identifier: box
+            for box in Box.select().where(Box.label_identifier << identifiers)
+        }
+        return [boxes[identifier] for identifier in identifiers]
+    raise BoxCreationFailed()
+
+
 def update_box(
     label_identifier,
     user_id,
@@ -100,6 +212,53 @@ def update_box(
     return box
 
 
+def update_boxes(
+    label_identifiers,
+    user_id,
+    comment=None,
+    items=None,
+    location_id=None,
+    product_id=None,
+    size_id=None,
+):
+    """Look up existing boxes given their label identifiers, and apply all requested
+    field updates to them in a single query (inside an atomic transaction). The box
+    state for the target location is looked up once. Insert timestamp for
+    modification.
+    Return the updated boxes in the order of the given identifiers, and the
+    identifiers that don't match any box.
+    """
+    updates = {Box.last_modified_by: user_id, Box.last_modified_on: utcnow()}
+    if comment is not None:
+        updates[Box.comment] = comment
+    if items is not None:
+        updates[Box.items] = items
+    if location_id is not None:
+        updates[Box.location] = location_id
+        location_box_state_id = Location.get_by_id(location_id).box_state_id
+        if location_box_state_id is not None:
+            updates[Box.state] = location_box_state_id
+    if product_id is not None:
+        updates[Box.product] = product_id
+    if size_id is not None:
+        updates[Box.size] = size_id
+
+    label_identifiers = list(dict.fromkeys(label_identifiers))  # remove duplicates
+    with db.database.atomic():
+        Box.update(updates).where(Box.label_identifier << label_identifiers).execute()
+        boxes = {
+            box.label_identifier: box
+            for box in Box.select().where(Box.label_identifier << label_identifiers)
+        }
+
+    return {
+        "updated_boxes": [boxes[i] for i in label_identifiers if i in boxes],
+        "invalid_box_label_identifiers": [
+            i for i in label_identifiers if i not in boxes
+        ],
+    }
+
+
 def create_beneficiary(
     *,
     user,
@@ -231,3 +390,36 @@ def create_qr_code(box_label_identifier=None):
             box.save()
 
     return new_qr_code
+
+
+def create_qr_codes(count):
+    """Insert `count` new QR codes in the database, and return them ordered by ID. Raise
+    InvalidQrCodeCount if the count is not positive, or exceeds
+    `MAX_QR_CODES_PER_REQUEST`.
+
+    As in `create_qr_code()`, the code is the MD5 hash of the primary key. Rows are
+    inserted in batches, with unique placeholder codes to identify them afterwards. The
+    hashes are then computed by the database in a single UPDATE statement.
+
+    QR codes created in bulk (e.g. for printing stickers) serve as pool: associating a
+    sticker with a box is a single UPDATE of the box's `qr_id`. A separate table of
+    pre-generated codes would not save round-trips in `create_qr_code()`: MySQL has no
+    `UPDATE ... RETURNING`, so claiming a code requires a locking SELECT in addition to
+    the UPDATE, just like the current INSERT and UPDATE.
+    """
+    if not 0 < count <= MAX_QR_CODES_PER_REQUEST:
+        raise InvalidQrCodeCount(maximum=MAX_QR_CODES_PER_REQUEST)
+
+    now = utcnow()
+    placeholders = [uuid.uuid4().hex for _ in range(count)]
+    with db.database.atomic():
+        for batch in peewee.chunked(placeholders, QR_CODE_INSERT_BATCH_SIZE):
+            QrCode.insert_many(
+                [{"code": code, "created_on": now} for code in batch]
+            ).execute()
+        ids = [
+            qr_code.id
+            for qr_code in QrCode.select(QrCode.id).where(QrCode.code << placeholders)
+        ]
+        QrCode.update(code=peewee.fn.MD5(QrCode.id)).where(QrCode.id << ids).execute()
+        return list(QrCode.select().where(QrCode.id << ids).order_by(QrCode.id))
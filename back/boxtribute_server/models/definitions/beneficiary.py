@@ -96,3 +96,23 @@ class Beneficiary(db.Model):
 
     class Meta:
         table_name = "people"
+        # Support keyset pagination of the beneficiaries of a base ordered by the
+        # respective field (InnoDB appends the primary key to secondary indexes). Added
+        # to existing databases by migration 0002
+        indexes = (
+            (("base", "first_name"), False),
+            (("base", "last_name"), False),
+            (("base", "group_identifier"), False),
+            (("base", "created_on"), False),
+        )
+
+
+# Support searching beneficiaries by words of their names or comment (see
+# graph_ql.filtering.derive_beneficiary_filter). Added to existing databases by
+# migration 0003
+Beneficiary.add_index(
+    SQL(
+        "CREATE FULLTEXT INDEX people_fulltext_search "
+        "ON people (firstname, lastname, comments)"
+    )
+)
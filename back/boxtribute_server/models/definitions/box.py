@@ -102,3 +102,10 @@ class Box(db.Model):
 
     class Meta:
         table_name = "stock"
+        # Support keyset pagination of the boxes of a location ordered by the respective
+        # field (InnoDB appends the primary key to secondary indexes). Added to existing
+        # databases by migration 0002
+        indexes = (
+            (("location", "label_identifier"), False),
+            (("location", "last_modified_on"), False),
+        )
@@ -0,0 +1,19 @@
+from peewee import DateField, IntegerField
+
+from ...db import db
+from ..fields import UIntForeignKeyField
+from .base import Base
+
+
+class DailySales(db.Model):
+    """Rollup of the number of items sold to beneficiaries of a base on a day (see
+    `metrics.refresh_metrics_rollups()`).
+    """
+
+    base = UIntForeignKeyField(model=Base, on_update="CASCADE", on_delete="CASCADE")
+    day = DateField()
+    number_of_sales = IntegerField()
+
+    class Meta:
+        table_name = "metrics_daily_sales"
+        indexes = ((("base", "day"), True),)
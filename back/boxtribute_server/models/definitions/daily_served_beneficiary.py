@@ -0,0 +1,20 @@
+from peewee import DateField
+
+from ...db import db
+from ..fields import UIntForeignKeyField
+from .beneficiary import Beneficiary
+
+
+class DailyServedBeneficiary(db.Model):
+    """Rollup of the beneficiaries that participated in a sale on a day (see
+    `metrics.refresh_metrics_rollups()`).
+    """
+
+    beneficiary = UIntForeignKeyField(
+        model=Beneficiary, on_update="CASCADE", on_delete="CASCADE"
+    )
+    day = DateField(index=True)
+
+    class Meta:
+        table_name = "metrics_daily_served_beneficiaries"
+        indexes = ((("beneficiary", "day"), True),)
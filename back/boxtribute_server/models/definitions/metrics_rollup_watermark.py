@@ -0,0 +1,14 @@
+from peewee import DateField
+
+from ...db import db
+
+
+class MetricsRollupWatermark(db.Model):
+    """Single-row table holding the day until which (excl.) the metrics rollup tables
+    are complete (see `metrics.refresh_metrics_rollups()`).
+    """
+
+    day = DateField()
+
+    class Meta:
+        table_name = "metrics_rollup_watermark"
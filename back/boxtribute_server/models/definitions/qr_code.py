@@ -1,7 +1,17 @@
+import os
+
 from peewee import SQL, CharField, DateTimeField, IntegerField
 
+from ...cache import Cache
 from ...db import db
 
+# Maximum number of QR codes cached for look-ups by code. Rows are never modified after
+# their code is assigned, hence cached rows don't become stale. Look-ups of absent codes
+# are not cached since the codes might be created later
+QR_CODE_CACHE_SIZE = int(os.getenv("QR_CODE_CACHE_SIZE", 10000))
+
+qr_code_cache = Cache(max_size=QR_CODE_CACHE_SIZE)
+
 
 class QrCode(db.Model):
     code = CharField(null=True)
@@ -10,8 +20,20 @@ class QrCode(db.Model):
 
     class Meta:
         table_name = "qr"
+        # Also serves look-ups by code alone since it's the leftmost column
         indexes = ((("code", "legacy"), True),)
 
+    @staticmethod
+    def get_by_code(code):
+        """Return the QR code with given code, or raise QrCode.DoesNotExist. The result
+        is cached.
+        """
+        qr_code = qr_code_cache.get(code)
+        if qr_code is None:
+            qr_code = QrCode.get(QrCode.code == code)
+            qr_code_cache.set(code, qr_code)
+        return qr_code
+
     @staticmethod
     def get_id_from_code(code):
-        return QrCode.get(QrCode.code == code).id
+        return QrCode.get_by_code(code).id
@@ -1,5 +1,5 @@
 """Custom peewee field types for data model definitions."""
-from peewee import CharField, DateTimeField, ForeignKeyField
+from peewee import CharField, DateTimeField, ForeignKeyAccessor, ForeignKeyField
 
 
 class EnumCharField(CharField):
@@ -32,10 +32,28 @@ class EnumCharField(CharField):
         return getattr(self.enum_class, name)
 
 
+class IdentityMapForeignKeyAccessor(ForeignKeyAccessor):
+    """Accessor looking up the referenced instance by primary key, such that it is
+    registered in (or retrieved from) the identity map of the current request.
+    """
+
+    def get_rel_instance(self, instance):
+        value = instance.__data__.get(self.name)
+        if (
+            value is not None
+            and self.name not in instance.__rel__
+            and self.field.lazy_load
+            and self.field.rel_field is self.rel_model._meta.primary_key
+        ):
+            instance.__rel__[self.name] = self.rel_model.get_by_id(value)
+        return super().get_rel_instance(instance)
+
+
 class UIntForeignKeyField(ForeignKeyField):
     """Work-around field type, since using constraints results in a syntax error.
     Always use this class to reference another model (note that database primary keys
-    are unsigned integers).
+    are unsigned integers). The referenced instance is retrieved via the identity map
+    of the current request (see `db.IdentityMap`).
     Cf. https://github.com/coleifer/peewee/issues/1594#issuecomment-386003608
 
     Details:
@@ -48,6 +66,7 @@ class UIntForeignKeyField(ForeignKeyField):
         ... INTEGER UNSIGNED NOT NULL
     """
 
+    accessor_class = IdentityMapForeignKeyAccessor
     field_type = "INTEGER UNSIGNED"
 
 
@@ -1,13 +1,18 @@
 """Computation of various metrics"""
-from peewee import JOIN, fn
+from peewee import JOIN, Select, fn
 
+from ..db import db, get_read_replica
 from .definitions.base import Base
 from .definitions.beneficiary import Beneficiary
 from .definitions.box import Box
+from .definitions.daily_sales import DailySales
+from .definitions.daily_served_beneficiary import DailyServedBeneficiary
 from .definitions.location import Location
+from .definitions.metrics_rollup_watermark import MetricsRollupWatermark
 from .definitions.product import Product
 from .definitions.product_category import ProductCategory
 from .definitions.transaction import Transaction
+from .utils import utcnow
 
 
 def _build_range_filter(field, *, low, high):
@@ -25,25 +30,65 @@ def _build_range_filter(field, *, low, high):
     return filter_
 
 
-def _served_beneficiaries(date_filter):
-    """Return IDs of beneficiaries that participated in a sale acc. to given
-    `date_filter`.
+def _rollup_watermark():
+    """Return the day until which (excl.) the rollup tables are complete, or None if
+    they have not been populated.
     """
-    return (
+    watermark = MetricsRollupWatermark.get_or_none()
+    return watermark.day if watermark is not None else None
+
+
+def _split_range(field, *, day_field, after, before, watermark):
+    """Split the date range between `after` and `before` at the given rollup watermark
+    (see `_rollup_watermark()`).
+    Return a filter for the days covered by the rollup tables (or None if the rollups
+    are not used), and a filter for the given fact field beyond the rollups.
+    The day-wise rollup filter is equivalent to the filter from `_build_range_filter()`
+    except for facts created exactly at midnight of the `after` or `before` day.
+    """
+    date_filter = _build_range_filter(field, low=after, high=before)
+    if watermark is None:
+        return None, date_filter
+
+    rollup_filter = day_field < watermark
+    if after:
+        rollup_filter &= day_field >= after
+    if before:
+        rollup_filter &= day_field < before
+    return rollup_filter, (date_filter) & (field >= watermark)
+
+
+def _served_beneficiaries(*, after, before, watermark):
+    """Return IDs of beneficiaries that participated in a sale in the date range between
+    `after` and `before`. Use rollups for the range covered by them.
+    """
+    rollup_filter, date_filter = _split_range(
+        Transaction.created_on,
+        day_field=DailyServedBeneficiary.day,
+        after=after,
+        before=before,
+        watermark=watermark,
+    )
+    served_beneficiaries = (
         Beneficiary.select(Beneficiary.id)
         .join(Transaction, JOIN.LEFT_OUTER)
         .where((date_filter) & (Transaction.count > 0) & (Transaction.tokens >= 0))
     ).distinct()
+    if rollup_filter is None:
+        return served_beneficiaries
+
+    # UNION removes duplicates
+    return (
+        DailyServedBeneficiary.select(DailyServedBeneficiary.beneficiary).where(
+            rollup_filter
+        )
+    ) | served_beneficiaries
 
 
-def compute_number_of_beneficiaries_served(*, organisation_id, after, before):
-    """Like `compute_number_of_families_served` but add up all members of served
-    families.
-    """
-    date_filter = _build_range_filter(Transaction.created_on, low=after, high=before)
-    served_beneficiaries = _served_beneficiaries(date_filter)
+def _number_of_beneficiaries_served(*, organisation_id, served_beneficiaries):
+    """Like `_number_of_families_served` but add up all members of served families."""
     return (
-        Beneficiary.select()
+        Beneficiary.select(fn.COUNT(Beneficiary.id))
         .join(Base)
         .where(
             (Base.organisation == organisation_id)
@@ -52,45 +97,159 @@ def compute_number_of_beneficiaries_served(*, organisation_id, after, before):
                 | (Beneficiary.id << served_beneficiaries)
             )
         )
-        .count()
     )
 
 
-def compute_number_of_families_served(*, organisation_id, after, before):
-    """Construct filter for date range, if at least one of `after` or `before` is given.
-    Compute number of families managed by `organisation_id` that were served in that
-    date range (default to all time).
+def _number_of_families_served(*, organisation_id, served_beneficiaries):
+    """Return subquery to count the families managed by `organisation_id` that are
+    part of the given served beneficiaries.
     """
-    date_filter = _build_range_filter(Transaction.created_on, low=after, high=before)
     return (
-        Beneficiary.select()
+        Beneficiary.select(fn.COUNT(Beneficiary.id))
         .join(Base)
         .where(
             (Base.organisation == organisation_id)
-            & (Beneficiary.id << (_served_beneficiaries(date_filter)))
+            & (Beneficiary.id << served_beneficiaries)
         )
-        .count()
     )
 
 
-def compute_number_of_sales(*, organisation_id, after, before):
-    """Construct filter for date range, if at least one of `after` or `before` is given.
-    Compute number of sales performed by `organisation_id` in that date range (default
-    to all time).
+def _number_of_sales(*, organisation_id, after, before, watermark):
+    """Return expression for the number of sales performed by `organisation_id` in the
+    date range. Use rollups for the range covered by them.
     """
-    date_filter = _build_range_filter(Transaction.created_on, low=after, high=before)
-    return (
-        Transaction.select(fn.sum(Transaction.count))
+    rollup_filter, date_filter = _split_range(
+        Transaction.created_on,
+        day_field=DailySales.day,
+        after=after,
+        before=before,
+        watermark=watermark,
+    )
+    # The sum is NULL if no Transactions selected
+    number_of_sales = fn.COALESCE(
+        Transaction.select(fn.SUM(Transaction.count))
         .join(Beneficiary)
         .join(Base)
         .where(
             (date_filter)
             & (Base.organisation == organisation_id)
             & (Transaction.tokens >= 0)
-        )
-        .scalar()  # returns None if no Transactions selected
-        or 0
+        ),
+        0,
     )
+    if rollup_filter is None:
+        return number_of_sales
+
+    return number_of_sales + fn.COALESCE(
+        DailySales.select(fn.SUM(DailySales.number_of_sales))
+        .join(Base)
+        .where((rollup_filter) & (Base.organisation == organisation_id)),
+        0,
+    )
+
+
+TRANSACTION_METRICS = [
+    "number_of_families_served",
+    "number_of_beneficiaries_served",
+    "number_of_sales",
+]
+
+
+def compute_transaction_metrics(*, organisation_id, after, before, names=None):
+    """Construct filter for date range, if at least one of `after` or `before` is given.
+    Compute the metrics of the given names (default: all `TRANSACTION_METRICS`) for
+    `organisation_id` in that date range (default to all time):
+    - number of families that were served
+    - number of beneficiaries that were served (i.e. all members of served families)
+    - number of sales performed
+    All metrics are computed in a single query. The set of served beneficiaries is
+    selected once, in a common table expression.
+    Return a dictionary mapping metric names to values.
+    """
+    names = TRANSACTION_METRICS if names is None else names
+    watermark = _rollup_watermark()
+    served_beneficiaries = _served_beneficiaries(
+        after=after, before=before, watermark=watermark
+    ).cte("served_beneficiaries", columns=["id"])
+    # Unlike with `select_from()`, the CTE is attached to the outer query only
+    served_beneficiary_ids = Select(
+        from_list=[served_beneficiaries], columns=[served_beneficiaries.c.id]
+    )
+
+    columns = []
+    for name in names:
+        if name == "number_of_sales":
+            column = _number_of_sales(
+                organisation_id=organisation_id,
+                after=after,
+                before=before,
+                watermark=watermark,
+            )
+        else:
+            compute = (
+                _number_of_families_served
+                if name == "number_of_families_served"
+                else _number_of_beneficiaries_served
+            )
+            column = compute(
+                organisation_id=organisation_id,
+                served_beneficiaries=served_beneficiary_ids,
+            )
+        columns.append(column.alias(name))
+
+    query = Select(columns=columns)
+    if set(names) - {"number_of_sales"}:
+        query = query.with_cte(served_beneficiaries)
+    database = get_read_replica() or Transaction._meta.database
+    return query.bind(database).dicts().get()
+
+
+def refresh_metrics_rollups(*, until=None, full=False):
+    """Aggregate transactions per day into the rollup tables, for all days from the
+    current watermark until the given day (excl.; default: today in UTC). Advance the
+    watermark accordingly.
+    Rollup rows in that range are replaced. If `full` is set, or if there is no
+    watermark yet, rebuild the rollups from the beginning of the history (backfill).
+    The transactions are written by dropapp, hence the rollups can't be maintained on
+    insertion. Instead, this function is meant to be invoked periodically (see the
+    `refresh-metrics` CLI command), adding the days passed since its last invocation.
+    """
+    until = until or utcnow().date()
+    since = None if full else _rollup_watermark()
+
+    day = fn.DATE(Transaction.created_on)
+    transaction_filter = Transaction.created_on < until
+    if since is not None:
+        transaction_filter &= Transaction.created_on >= since
+
+    with db.database.atomic():
+        for model in [DailySales, DailyServedBeneficiary]:
+            model.delete().where(
+                model.day < until if since is None else model.day.between(since, until)
+            ).execute()
+
+        DailySales.insert_from(
+            Transaction.select(Beneficiary.base, day, fn.sum(Transaction.count))
+            .join(Beneficiary)
+            .where((transaction_filter) & (Transaction.tokens >= 0))
+            .group_by(Beneficiary.base, day),
+            [DailySales.base, DailySales.day, DailySales.number_of_sales],
+        ).execute()
+
+        DailyServedBeneficiary.insert_from(
+            Transaction.select(Transaction.beneficiary, day)
+            .where(
+                (transaction_filter)
+                & (Transaction.beneficiary.is_null(False))
+                & (Transaction.count > 0)
+                & (Transaction.tokens >= 0)
+            )
+            .group_by(Transaction.beneficiary, day),
+            [DailyServedBeneficiary.beneficiary, DailyServedBeneficiary.day],
+        ).execute()
+
+        MetricsRollupWatermark.delete().execute()
+        MetricsRollupWatermark.create(day=until)
 
 
 def compute_stock_overview(*, organisation_id):
@@ -120,6 +279,12 @@ def compute_moved_stock_overview(*, organisation_id, after, before):
     """Construct filter for date range, if at least one of `after` or `before` is given.
     Compute number of boxes, and contained items, moved by `organisation_id` that were
     served in that date range (default to all time). Group by ProductCategory.
+
+    Unlike the transaction metrics, the moved stock is not rolled up: it is derived from
+    the current box rows (the time of their last modification, and the flags of their
+    current location), and any later change of a box moves it out of the day that it
+    was counted for. There is no history of box changes to aggregate instead (the
+    `history` table is not written by box mutations).
     """
     date_filter = _build_range_filter(Box.last_modified_on, low=after, high=before)
 
@@ -1,14 +1,32 @@
 """Construction of routes for web app and API"""
 import os
 
-from ariadne import graphql_sync
 from ariadne.constants import PLAYGROUND_HTML
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, g, jsonify, request
 from flask_cors import cross_origin
 
-from .auth import request_jwt, requires_auth
+from .auth import request_jwt, requires_auth, token_cache
+from .db import READ_YOUR_WRITES_HEADER, db, pop_write_token
 from .exceptions import AuthenticationFailed, format_database_errors
+from .graph_ql.cost import QUERY_API_COST_LIMIT
+from .graph_ql.execution import document_cache, execute_graphql, persisted_queries
+from .graph_ql.pagination import total_count_cache
 from .graph_ql.schema import full_api_schema, query_api_schema
+from .instrumentation import QueryMonitorExtension, TracingExtension, metrics_registry
+from .models.definitions.qr_code import qr_code_cache
+
+# If set, trace resolvers and SQL queries of GraphQL requests (see `instrumentation`)
+GRAPHQL_TRACING = bool(os.getenv("GRAPHQL_TRACING", False))
+
+
+def graphql_extensions():
+    extensions = []
+    if GRAPHQL_TRACING:
+        extensions.append(TracingExtension)
+    if current_app.config.get("MONITOR_SQL_QUERIES"):
+        extensions.append(QueryMonitorExtension)
+    return extensions
+
 
 # Blueprint for query-only API. Deployed on the 'api*' subdomains
 api_bp = Blueprint("api_bp", __name__)
@@ -17,6 +35,17 @@ api_bp = Blueprint("api_bp", __name__)
 app_bp = Blueprint("app_bp", __name__)
 
 
+@api_bp.before_request
+@app_bp.before_request
+def reset_request_state():
+    # The g object is bound to the app context which might outlive a single request
+    # (e.g. in tests). Avoid leaking loaded resources into the next request
+    g.pop("loaders", None)
+    g.pop("identity_map", None)
+    g.pop("read_replica", None)
+    g.pop("write_token", None)
+
+
 @api_bp.errorhandler(AuthenticationFailed)
 @app_bp.errorhandler(AuthenticationFailed)
 def handle_auth_error(ex):
@@ -43,12 +72,14 @@ def query_api_playground():
 @cross_origin(origin="localhost", headers=["Content-Type", "Authorization"])
 @requires_auth
 def query_api_server():
-    success, result = graphql_sync(
+    success, result = execute_graphql(
         query_api_schema,
         data=request.get_json(),
         context_value=request,
         introspection=os.getenv("FLASK_ENV") == "development",
         error_formatter=format_database_errors,
+        extensions=graphql_extensions(),
+        cost_limit=QUERY_API_COST_LIMIT,
     )
 
     status_code = 200 if success else 400
@@ -79,21 +110,52 @@ def graphql_playgroud():
 
 
 @app_bp.route("/graphql", methods=["POST"])
-@cross_origin(origin="localhost", headers=["Content-Type", "Authorization"])
+@cross_origin(
+    origin="localhost",
+    headers=["Content-Type", "Authorization", READ_YOUR_WRITES_HEADER],
+    expose_headers=[READ_YOUR_WRITES_HEADER],
+)
 @requires_auth
 def graphql_server():
     # Note: Passing the request to the context is optional.
     # In Flask, the current request is always accessible as flask.request
 
     debug_graphql = bool(os.getenv("DEBUG_GRAPHQL", False))
-    success, result = graphql_sync(
+    success, result = execute_graphql(
         full_api_schema,
         data=request.get_json(),
         context_value=request,
         debug=debug_graphql,
         introspection=os.getenv("FLASK_ENV") == "development",
         error_formatter=format_database_errors,
+        extensions=graphql_extensions(),
     )
 
     status_code = 200 if success else 400
-    return jsonify(result), status_code
+    headers = {}
+    write_token = pop_write_token()
+    if write_token is not None:
+        headers[READ_YOUR_WRITES_HEADER] = write_token
+    return jsonify(result), status_code, headers
+
+
+@app_bp.route("/metrics", methods=["GET"])
+def metrics():
+    """Expose aggregated request metrics, statistics of in-process caches, and of the
+    database connection pool (if enabled) in Prometheus text format.
+    """
+    caches = {
+        "documents": document_cache,
+        "persisted_queries": persisted_queries,
+        "qr_codes": qr_code_cache,
+        "tokens": token_cache,
+        "total_counts": total_count_cache,
+    }
+    pool_statistics = None
+    if hasattr(db.database, "pool_statistics"):
+        pool_statistics = db.database.pool_statistics()
+    return (
+        metrics_registry.render(caches, pool_statistics=pool_statistics),
+        200,
+        {"Content-Type": "text/plain; version=0.0.4"},
+    )
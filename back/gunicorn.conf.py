@@ -1,8 +1,37 @@
 """Configuration for gunicorn WSGI server. For possible settings see
 https://docs.gunicorn.org/en/stable/settings.html#
+
+By default, the number of worker processes and threads per worker are derived from the
+number of CPUs available to the process (at most MAX_DEFAULT_CPUS). They can be
+overridden by the environment variables GUNICORN_WORKERS
+and GUNICORN_THREADS. Set GUNICORN_WORKER_CLASS=gevent to use greenlets instead of
+threads (requires the gevent package).
+
+Request state is thread-safe: the request-scoped `flask.g` (holding the current user,
+the data loaders, and the identity map) and the peewee connection state are local to
+the thread handling the request. The GraphQL schemas are immutable after import, and
+the process-wide caches and metrics guard their state with locks.
 """
-workers = 1
-threads = 1
+import os
+
+# Containers and App Engine instances report the CPUs of the host machine, and neither
+# the CPU count nor the scheduler affinity reflect CPU quotas. Limit the default number
+# of processes and threads, and hence of concurrent database connections
+MAX_DEFAULT_CPUS = 2
+try:
+    cpu_count = len(os.sched_getaffinity(0))
+except AttributeError:  # not available on macOS
+    cpu_count = os.cpu_count() or 1
+cpu_count = min(cpu_count, MAX_DEFAULT_CPUS)
+
+# Processes serve requests in parallel; cf.
+# https://docs.gunicorn.org/en/stable/design.html#how-many-workers
+workers = int(os.getenv("GUNICORN_WORKERS") or 2 * cpu_count + 1)
+# Threads serve other requests while waiting for database responses
+worker_class = os.getenv("GUNICORN_WORKER_CLASS") or "gthread"
+threads = int(os.getenv("GUNICORN_THREADS") or 2 * cpu_count)
+if worker_class == "gevent":
+    worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS") or 100)
 bind = "0.0.0.0:5000"
 wsgi_app = "boxtribute_server.main:app"
 # loglevel = "debug"
@@ -13,6 +13,19 @@
 // 7. Experiment with GraphQL queries of varying complexity
 // 8. Experiment with different WSGI server settings (gunicorn.conf.py file)
 //    Remember to re-launch the Docker service for changes to take effect
+// 9. Compare the throughput of the serving profiles by running the 'concurrency'
+//    scenario: users requesting cheap queries while others request expensive metrics
+//    a) single-threaded: launch the Docker service as in 2. with the environment
+//       variables GUNICORN_WORKERS=1 GUNICORN_THREADS=1
+//    b) default (derived from CPU count): launch without GUNICORN_* variables
+//    and run: dotenv run k6 run -e SCENARIO=concurrency back/scripts/load-test.js
+//    and inspect the 'http_reqs' rate and the 'http_req_duration{query:cheap}' trend
+// 10. Benchmark the throughput of moving boxes by running the 'box-moves' scenario
+//    (modifies the database!). The boxes of the location LOCATION_ID are moved to
+//    the location TARGET_LOCATION_ID, once by one updateBox mutation per box, and
+//    once by a single updateBoxes mutation
+//    dotenv run k6 run -e SCENARIO=box-moves -e LOCATION_ID=1 -e TARGET_LOCATION_ID=2 back/scripts/load-test.js
+//    and compare the 'iteration_duration' trends of the two scenarios
 //
 // Explanation of metrics: https://k6.io/docs/using-k6/metrics/#http-specific-built-in-metrics
 import http from "k6/http";
@@ -34,35 +47,128 @@ const payload = JSON.stringify({
   query: "query { beneficiaries { elements { firstName } } }",
 });
 
+const cheapPayload = JSON.stringify({
+  query: "query { beneficiary(id: 1007) { firstName } }",
+});
+const expensivePayload = JSON.stringify({
+  query:
+    "query { metrics { numberOfFamiliesServed numberOfBeneficiariesServed numberOfSales } }",
+});
+
+const concurrencyScenarios = {
+  cheap: {
+    executor: "constant-vus",
+    exec: "requestCheapQuery",
+    vus: 10,
+    duration: "30s",
+  },
+  expensive: {
+    executor: "constant-vus",
+    exec: "requestExpensiveQuery",
+    vus: 2,
+    duration: "30s",
+  },
+};
+
+const boxMovesScenarios = {
+  single: {
+    executor: "per-vu-iterations",
+    exec: "moveBoxesSequentially",
+    vus: 1,
+    iterations: 5,
+  },
+  bulk: {
+    executor: "per-vu-iterations",
+    exec: "moveBoxesInBulk",
+    vus: 1,
+    iterations: 5,
+    startTime: "60s",
+  },
+};
+
+const defaultScenarios = {
+  /*
+  shared: {
+    executor: 'shared-iterations',
+
+    // common scenario configuration
+    // startTime: '10s',
+    gracefulStop: '5s',
+
+    // executor-specific configuration
+    vus: 10,
+    iterations: 100,
+    // maxDuration: '10s',
+  },
+  */
+  ramping: {
+    executor: "ramping-vus",
+    startVUs: 0,
+    stages: [
+      { duration: "10s", target: 10 },
+      { duration: "20s", target: 10 },
+      { duration: "5s", target: 0 },
+    ],
+    gracefulRampDown: "0s",
+  },
+};
+
 export const options = {
   scenarios: {
-    /*
-    shared: {
-      executor: 'shared-iterations',
-
-      // common scenario configuration
-      // startTime: '10s',
-      gracefulStop: '5s',
-
-      // executor-specific configuration
-      vus: 10,
-      iterations: 100,
-      // maxDuration: '10s',
-    },
-    */
-    ramping: {
-      executor: "ramping-vus",
-      startVUs: 0,
-      stages: [
-        { duration: "10s", target: 10 },
-        { duration: "20s", target: 10 },
-        { duration: "5s", target: 0 },
-      ],
-      gracefulRampDown: "0s",
-    },
+    concurrency: concurrencyScenarios,
+    "box-moves": boxMovesScenarios,
+  }[__ENV.SCENARIO] || defaultScenarios,
+  thresholds: {
+    "iteration_duration{scenario:single}": ["p(95)>=0"],
+    "iteration_duration{scenario:bulk}": ["p(95)>=0"],
+    // Sub-metrics are only reported if a threshold is defined for them
+    "http_req_duration{query:cheap}": ["p(95)>=0"],
+    "http_req_duration{query:expensive}": ["p(95)>=0"],
   },
 };
 
+export function requestCheapQuery() {
+  http.post(url, cheapPayload, { ...params, tags: { query: "cheap" } });
+}
+
+export function requestExpensiveQuery() {
+  http.post(url, expensivePayload, { ...params, tags: { query: "expensive" } });
+}
+
+export function setup() {
+  if (__ENV.SCENARIO !== "box-moves") {
+    return {};
+  }
+  const query = `query { location(id: ${__ENV.LOCATION_ID}) {
+    boxes(paginationInput: { first: 100 }) { elements { labelIdentifier } } } }`;
+  const res = http.post(url, JSON.stringify({ query }), params);
+  const labelIdentifiers = res
+    .json()
+    .data.location.boxes.elements.map((b) => b.labelIdentifier);
+  return { labelIdentifiers };
+}
+
+// Alternate the boxes between the two locations
+function targetLocationId() {
+  return __ITER % 2 === 0 ? __ENV.TARGET_LOCATION_ID : __ENV.LOCATION_ID;
+}
+
+export function moveBoxesSequentially(data) {
+  const locationId = targetLocationId();
+  for (const labelIdentifier of data.labelIdentifiers) {
+    const query = `mutation { updateBox(updateInput: {
+      labelIdentifier: "${labelIdentifier}", locationId: ${locationId} }) { id } }`;
+    http.post(url, JSON.stringify({ query }), params);
+  }
+}
+
+export function moveBoxesInBulk(data) {
+  const query = `mutation { updateBoxes(updateInput: {
+    labelIdentifiers: ${JSON.stringify(data.labelIdentifiers)},
+    locationId: ${targetLocationId()} }) { updatedBoxes { id } } }`;
+  http.post(url, JSON.stringify({ query }), params);
+}
+
 export default function () {
   const res = http.post(url, payload, params);
 
@@ -1,5 +1,16 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
 import pytest
-from boxtribute_server.auth import get_token_from_auth_header
+from auth import create_jwt_payload
+from boxtribute_server.auth import (
+    JwksCache,
+    get_current_user,
+    get_token_from_auth_header,
+)
+from boxtribute_server.cache import Cache
 from boxtribute_server.exceptions import AuthenticationFailed
 
 
@@ -21,3 +32,118 @@ def test_get_invalid_jwt_bearer_no_token():
 def test_get_invalid_jwt_bearer_with_additonal_data():
     with pytest.raises(AuthenticationFailed):
         get_token_from_auth_header("bearer token additional")
+
+
+@pytest.fixture
+def jwks_server():
+    """Serve a JWKS on a local HTTP server, mimicking the Auth0 service. The served keys
+    can be modified, and the number of received requests is tracked.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            server.number_of_requests += 1
+            if server.jwks is None:
+                self.send_error(503)
+                return
+            body = json.dumps(server.jwks).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *_):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    server.jwks = {"keys": [{"kid": "a"}]}
+    server.number_of_requests = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+class Clock:
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+
+def test_jwks_cache(jwks_server):
+    clock = Clock()
+    port = jwks_server.server_address[1]
+    cache = JwksCache(
+        url=f"http://127.0.0.1:{port}/{{domain}}/.well-known/jwks.json",
+        ttl=10,
+        stale_ttl=100,
+        min_refetch_interval=5,
+        clock=clock,
+    )
+
+    # Key set is fetched once, and then served from the cache
+    assert cache.get_key("domain", "a") == {"kid": "a"}
+    assert cache.get_key("domain") == {"kid": "a"}
+    assert jwks_server.number_of_requests == 1
+
+    # Key rotation: unknown key ID triggers refetch, unless the last fetch is too recent
+    jwks_server.jwks = {"keys": [{"kid": "a"}, {"kid": "b"}]}
+    with pytest.raises(AuthenticationFailed):
+        cache.get_key("domain", "b")
+    assert jwks_server.number_of_requests == 1
+    clock.time = 6
+    assert cache.get_key("domain", "b") == {"kid": "b"}
+    assert jwks_server.number_of_requests == 2
+    with pytest.raises(AuthenticationFailed):
+        cache.get_key("domain", "c")
+    assert jwks_server.number_of_requests == 2
+
+    # Stale key set is served while being refreshed in the background
+    jwks_server.jwks = {"keys": [{"kid": "c"}]}
+    clock.time = 20
+    assert cache.get_key("domain", "b") == {"kid": "b"}
+    cache._refresh_threads["domain"].join()
+    assert jwks_server.number_of_requests == 3
+    assert cache.get_key("domain", "c") == {"kid": "c"}
+    assert jwks_server.number_of_requests == 3
+
+    # Stale key set is kept if refreshing fails
+    jwks_server.jwks = None
+    clock.time = 40
+    assert cache.get_key("domain", "c") == {"kid": "c"}
+    cache._refresh_threads["domain"].join()
+    assert jwks_server.number_of_requests == 4
+    assert cache.get_key("domain", "c") == {"kid": "c"}
+
+    # Key set beyond stale TTL is fetched synchronously
+    jwks_server.jwks = {"keys": [{"kid": "d"}]}
+    clock.time = 200
+    assert cache.get_key("domain", "d") == {"kid": "d"}
+
+
+def test_get_current_user_from_cache(mocker):
+    mocker.patch("boxtribute_server.auth.token_cache", Cache())
+    mocker.patch("boxtribute_server.auth.get_public_key")
+    payload = create_jwt_payload(user_id=3)
+    decode = mocker.patch("jose.jwt.decode", return_value=payload)
+    params = dict(domain="domain", audience="audience")
+
+    # Tokens without expiration time are not cached
+    for _ in range(2):
+        assert get_current_user(token="token", **params).id == 3
+    assert decode.call_count == 2
+
+    # Tokens are verified once until they expire
+    payload["exp"] = time.time() + 60
+    for _ in range(2):
+        assert get_current_user(token="token", **params).id == 3
+    assert decode.call_count == 3
+    assert get_current_user(token="other-token", **params).id == 3
+    assert decode.call_count == 4
+
+    payload["exp"] = time.time() - 60
+    for _ in range(2):
+        assert get_current_user(token="expired-token", **params).id == 3
+    assert decode.call_count == 6
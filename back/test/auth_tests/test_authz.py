@@ -1,3 +1,5 @@
+import json
+
 import pytest
 from boxtribute_server.auth import CurrentUser
 from boxtribute_server.authz import authorize
@@ -29,7 +31,7 @@ def test_authorized_user():
     assert authorize(user, organisation_id=2)
     assert authorize(user, user_id=3)
 
-    user = CurrentUser(id=3, organisation_id=2, base_ids=ALL_PERMISSIONS)
+    user = CurrentUser(id=3, organisation_id=2, base_ids=dict.fromkeys(ALL_PERMISSIONS))
     assert authorize(user, permission="base:read")
     assert authorize(user, permission="beneficiary:read")
     assert authorize(user, permission="category:read")
@@ -96,3 +98,15 @@ def test_god_user():
     user = CurrentUser(id=0, organisation_id=0, is_god=True)
     for permission in ALL_PERMISSIONS:
         assert authorize(user, permission=permission)
+
+
+def test_user_with_base_specific_permissions_unauthorized():
+    user = CurrentUser(
+        id=3, organisation_id=2, base_ids={"stock:read": [3, 2], "base:read": None}
+    )
+    assert user.authorized_base_ids("stock:read") == frozenset([2, 3])
+    with pytest.raises(Forbidden) as exc_info:
+        authorize(user, permission="stock:read", base_id=1)
+    # The user information in the error extensions must be JSON-serializable
+    user_info = json.loads(json.dumps(exc_info.value.extensions["user"]))
+    assert user_info["_base_ids"] == {"stock:read": [2, 3], "base:read": None}
@@ -16,6 +16,8 @@ import pymysql
 import pytest
 from boxtribute_server.app import configure_app, create_app
 from boxtribute_server.db import create_db_interface, db
+from boxtribute_server.instrumentation import capture_sql_queries
+from boxtribute_server.models.definitions.qr_code import qr_code_cache
 from boxtribute_server.routes import api_bp, app_bp
 
 # Imports fixtures into tests
@@ -70,8 +72,15 @@ def _create_app(database_interface, *blueprints):
     scopes (cf. https://github.com/pytest-dev/pytest/issues/3425#issuecomment-383835876)
     """
     app = create_app()
-    configure_app(app, *blueprints, database_interface=database_interface)
+    configure_app(
+        app,
+        *blueprints,
+        database_interface=database_interface,
+        monitor_sql_queries=True,
+    )
 
+    # Cached rows would outlive the re-created tables
+    qr_code_cache.clear()
     with db.database.bind_ctx(MODELS):
         db.database.drop_tables(MODELS)
         db.database.create_tables(MODELS)
@@ -107,6 +116,25 @@ def client(mysql_testing_database):
         yield app.test_client()
 
 
+@pytest.fixture
+def max_queries():
+    """Function fixture returning a context manager that asserts that at most the given
+    number of SQL queries are executed within the context. Usage:
+
+        def test_query(read_only_client, max_queries):
+            with max_queries(2):
+                assert_successful_request(read_only_client, query)
+    """
+
+    @contextmanager
+    def assert_max_queries(number):
+        with capture_sql_queries() as statements:
+            yield statements
+        assert len(statements) <= number, "\n".join(statements)
+
+    return assert_max_queries
+
+
 @pytest.fixture
 def dropapp_dev_client():
     """Function fixture for any tests that include read-only operations on the
@@ -56,6 +56,7 @@ from .transfer_agreement import (
     unidirectional_transfer_agreement,
 )
 from .user import default_user, default_users
+from .x_beneficiary_language import beneficiary_languages
 
 __all__ = [
     "another_box",
@@ -66,6 +67,7 @@ __all__ = [
     "another_shipment",
     "another_shipment_detail",
     "another_size",
+    "beneficiary_languages",
     "box_without_qr_code",
     "canceled_shipment",
     "default_beneficiary",
@@ -0,0 +1,32 @@
+import pytest
+from boxtribute_server.enums import Language
+from boxtribute_server.models.definitions.x_beneficiary_language import (
+    XBeneficiaryLanguage,
+)
+from data.beneficiary import default_beneficiary_data, relative_beneficiary_data
+
+
+def data():
+    return [
+        {
+            "beneficiary": default_beneficiary_data()["id"],
+            "language": Language.en.value,
+        },
+        {
+            "beneficiary": default_beneficiary_data()["id"],
+            "language": Language.ar.value,
+        },
+        {
+            "beneficiary": relative_beneficiary_data()["id"],
+            "language": Language.nl.value,
+        },
+    ]
+
+
+@pytest.fixture
+def beneficiary_languages():
+    return data()
+
+
+def create():
+    XBeneficiaryLanguage.insert_many(data()).execute()
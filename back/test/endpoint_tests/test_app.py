@@ -1,7 +1,27 @@
+import hashlib
+import threading
+import time
+
 import peewee
 import pytest
 from auth import create_jwt_payload
-from utils import assert_bad_user_input, assert_internal_server_error
+from boxtribute_server.app import configure_app, create_app
+from boxtribute_server.cache import Cache
+from boxtribute_server.db import READ_YOUR_WRITES_HEADER, create_db_interface, db
+from boxtribute_server.graph_ql import execution
+from boxtribute_server.graph_ql.schema import full_api_schema
+from boxtribute_server.instrumentation import (
+    MetricsRegistry,
+    QueryMonitorExtension,
+    TracingExtension,
+    normalize_sql,
+)
+from graphql.pyutils import Path
+from utils import (
+    assert_bad_user_input,
+    assert_internal_server_error,
+    assert_successful_request,
+)
 
 
 def test_base_specific_permissions(client, mocker):
@@ -140,3 +160,393 @@ def test_mutation_arbitrary_database_error(read_only_client, mocker):
     ).side_effect = peewee.PeeweeException
     mutation = "mutation { createQrCode { id } }"
     assert_internal_server_error(read_only_client, mutation, field="createQrCode")
+
+
+def test_automatic_persisted_queries(read_only_client, mocker):
+    mocker.patch("boxtribute_server.graph_ql.execution.persisted_queries", Cache())
+    query = "query { base(id: 1) { id } }"
+    query_hash = hashlib.sha256(query.encode()).hexdigest()
+    extensions = {"persistedQuery": {"version": 1, "sha256Hash": query_hash}}
+
+    # Unknown hash
+    response = read_only_client.post("/graphql", json={"extensions": extensions})
+    assert response.status_code == 400
+    assert (
+        response.json["errors"][0]["extensions"]["code"] == "PERSISTED_QUERY_NOT_FOUND"
+    )
+
+    # Register query
+    data = {"query": query, "extensions": extensions}
+    response = read_only_client.post("/graphql", json=data)
+    assert response.status_code == 200
+    assert response.json["data"] == {"base": {"id": "1"}}
+
+    response = read_only_client.post("/graphql", json={"extensions": extensions})
+    assert response.status_code == 200
+    assert response.json["data"] == {"base": {"id": "1"}}
+
+    # Hash does not match query
+    data = {"query": "query { bases { id } }", "extensions": extensions}
+    response = read_only_client.post("/graphql", json=data)
+    assert response.status_code == 400
+    assert response.json["errors"][0]["extensions"]["code"] == "BAD_USER_INPUT"
+
+    # Hash is not a string
+    for query_hash in [["abc"], {"a": 1}, None, 1]:
+        extensions = {"persistedQuery": {"version": 1, "sha256Hash": query_hash}}
+        for data in [
+            {"extensions": extensions},
+            {"query": query, "extensions": extensions},
+        ]:
+            response = read_only_client.post("/graphql", json=data)
+            assert response.status_code == 400
+            assert response.json["errors"][0]["extensions"]["code"] == "BAD_USER_INPUT"
+
+
+def test_query_document_cache(read_only_client, mocker):
+    cache = mocker.patch("boxtribute_server.graph_ql.execution.document_cache", Cache())
+    parse = mocker.spy(execution, "parse_query")
+    validate = mocker.spy(execution, "validate_query")
+    query = "query { base(id: 1) { id } }"
+    for _ in range(3):
+        response = read_only_client.post("/graphql", json={"query": query})
+        assert response.json["data"] == {"base": {"id": "1"}}
+    assert parse.call_count == 1
+    assert validate.call_count == 1
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    # Invalid documents are not cached
+    query = "query { base(id: 1) { unknownField } }"
+    for _ in range(2):
+        response = read_only_client.post("/graphql", json={"query": query})
+        assert response.status_code == 400
+    assert validate.call_count == 3
+
+
+def test_query_api_cost_limit(read_only_client, mocker):
+    mocker.patch("boxtribute_server.routes.QUERY_API_COST_LIMIT", 2000)
+    query = "query { bases { beneficiaries { elements { id } } } }"
+    response = read_only_client.post("/", json={"query": query})
+    assert response.status_code == 200
+    assert response.json["extensions"]["cost"] == {
+        "requestedQueryCost": 20 * (1 + 1 + 50),
+        "maximumAvailable": 2000,
+    }
+
+    # Page size given via variables and fragments are taken into account
+    query = """query Beneficiaries($pagination: PaginationInput) {
+        ...Bases
+        base(id: 1) {
+            beneficiaries(paginationInput: $pagination) { elements { tokens } }
+        }
+    }
+    fragment Bases on Query { bases { id } }"""
+    data = {"query": query, "variables": {"pagination": {"first": 5}}}
+    response = read_only_client.post("/", json=data)
+    assert response.status_code == 200
+    cost = response.json["extensions"]["cost"]["requestedQueryCost"]
+    assert cost == 20 + (1 + 1 + 5 * (1 + 1))
+
+    query = "query { bases { beneficiaries { elements { transactions { id } } } } }"
+    response = read_only_client.post("/", json={"query": query})
+    assert response.status_code == 400
+    assert "data" not in response.json
+    assert response.json["errors"][0]["extensions"]["cost"] == {
+        "requestedQueryCost": 20 * (1 + 1 + 50 * (1 + 50 * 1)),
+        "maximumAvailable": 2000,
+    }
+
+    # A negative page size does not cancel out the cost of an expensive sibling field
+    negative_query = """query { base(id: 1) { beneficiaries(
+        paginationInput: {first: -1000}) { elements { transactions { id } } } }
+        bases { beneficiaries { elements { transactions { id } } } } }"""
+    response = read_only_client.post("/", json={"query": negative_query})
+    assert response.status_code == 400
+    assert "data" not in response.json
+    assert response.json["errors"][0]["extensions"]["cost"] == {
+        "requestedQueryCost": (1 + 1 + 1000 * (1 + 50 * 1))
+        + 20 * (1 + 1 + 50 * (1 + 50 * 1)),
+        "maximumAvailable": 2000,
+    }
+
+    # The cost is not limited for the app GraphQL endpoint
+    response = read_only_client.post("/graphql", json={"query": query})
+    assert response.status_code == 200
+    assert "extensions" not in response.json
+
+
+def test_graphql_tracing(read_only_client, mocker):
+    mocker.patch("boxtribute_server.routes.GRAPHQL_TRACING", True)
+    registry = MetricsRegistry()
+    mocker.patch("boxtribute_server.instrumentation.metrics_registry", registry)
+    mocker.patch("boxtribute_server.routes.metrics_registry", registry)
+    query = "query { beneficiaries { elements { id tokens } } }"
+    response = read_only_client.post("/graphql", json={"query": query})
+    assert response.status_code == 200
+
+    tracing = response.json["extensions"]["tracing"]
+    assert tracing["version"] == 1
+    resolvers = {tuple(r["path"]): r for r in tracing["execution"]["resolvers"]}
+    # Fields with default resolvers are not traced
+    assert ("beneficiaries", "elements", 0, "id") not in resolvers
+    assert resolvers[("beneficiaries",)]["sqlQueries"] == 1
+    # Tokens of all beneficiaries are loaded when resolving the first element
+    assert resolvers[("beneficiaries", "elements", 0, "tokens")]["sqlQueries"] == 1
+    assert resolvers[("beneficiaries", "elements", 1, "tokens")]["sqlQueries"] == 0
+
+    response = read_only_client.get("/metrics")
+    assert response.status_code == 200
+    lines = response.get_data(as_text=True).splitlines()
+    assert "graphql_request_duration_seconds_count 1" in lines
+    assert (
+        'graphql_field_duration_seconds_count{field="Query.beneficiaries"} 1' in lines
+    )
+    assert 'graphql_field_sql_queries_total{field="Beneficiary.tokens"} 1' in lines
+    assert (
+        'graphql_field_duration_seconds_count{field="Beneficiary.tokens"} '
+        f"{len(resolvers) - 1}" in lines
+    )
+
+
+def _resolve_concurrently(extension, mocker, base_queries, organisation_queries):
+    """Resolve the `base` and `organisation` fields in separate threads (as with the
+    ASGI app), such that resolving the base starts and ends while resolving the
+    organisation. The resolvers report the given SQL queries to the extension.
+    """
+    query_type = full_api_schema.query_type
+    base_started = threading.Event()
+    organisation_started = threading.Event()
+    organisation_continued = threading.Event()
+
+    def resolve_base(*_):
+        base_started.set()
+        organisation_started.wait()
+        for sql in base_queries:
+            extension.record_sql(sql, 1)
+        return "base"
+
+    def resolve_organisation(*_):
+        organisation_started.set()
+        organisation_continued.wait()
+        for sql in organisation_queries:
+            extension.record_sql(sql, 1)
+        return "organisation"
+
+    def run(name, resolver):
+        info = mocker.Mock(
+            field_name=name, parent_type=query_type, path=Path(None, name, "Query")
+        )
+        extension.resolve(resolver, None, info)
+
+    base_thread = threading.Thread(target=run, args=["base", resolve_base])
+    organisation_thread = threading.Thread(
+        target=run, args=["organisation", resolve_organisation]
+    )
+    base_thread.start()
+    base_started.wait()
+    organisation_thread.start()
+    base_thread.join()
+    organisation_continued.set()
+    organisation_thread.join()
+
+
+def test_graphql_tracing_of_concurrent_resolvers(read_only_client, mocker):
+    mocker.patch(
+        "boxtribute_server.instrumentation.metrics_registry", MetricsRegistry()
+    )
+    extension = TracingExtension()
+    with read_only_client.application.app_context():
+        extension.request_started(None)
+        _resolve_concurrently(extension, mocker, ["SELECT 1"], ["SELECT 1", "SELECT 2"])
+        extension.request_finished(None)
+
+    records = {r["fieldName"]: r for r in extension.resolvers}
+    assert records["base"]["sqlQueries"] == 1
+    assert records["organisation"]["sqlQueries"] == 2
+    assert extension.sql_queries == 3
+
+
+def test_sql_query_monitoring_of_concurrent_resolvers(read_only_client, mocker):
+    extension = QueryMonitorExtension()
+    with read_only_client.application.app_context():
+        extension.request_started(None)
+        _resolve_concurrently(extension, mocker, ["SELECT 1"], ["SELECT 2"])
+        extension.request_finished(None)
+
+    assert extension.paths_by_shape == {
+        "SELECT 1": ["base"],
+        "SELECT 2": ["organisation"],
+    }
+
+
+def test_sql_query_monitoring(read_only_client, mocker, caplog, max_queries):
+    mocker.patch("boxtribute_server.instrumentation.SLOW_QUERY_THRESHOLD", -1)
+    mocker.patch("boxtribute_server.instrumentation.N_PLUS_ONE_THRESHOLD", 1)
+    query = "query { beneficiaries { elements { id tokens } } }"
+    with max_queries(2):
+        assert_successful_request(read_only_client, query)
+    messages = [r.getMessage() for r in caplog.records]
+    assert len([m for m in messages if m.startswith("Slow SQL query")]) == 2
+    assert any(
+        m.startswith("Slow SQL query") and " at beneficiaries.elements.0.tokens: " in m
+        for m in messages
+    )
+    assert not any(m.startswith("Suspected N+1 pattern") for m in messages)
+
+    # Base of each beneficiary is fetched with the same query (cached by identity map)
+    caplog.clear()
+    query = "query { beneficiaries { elements { base { name } } } }"
+    assert_successful_request(read_only_client, query)
+    messages = [r.getMessage() for r in caplog.records]
+    assert not any(m.startswith("Suspected N+1 pattern") for m in messages)
+
+    caplog.clear()
+    query = """query { first: beneficiary(id: 1) { id }
+        second: beneficiary(id: 2) { id } }"""
+    response = read_only_client.post("/graphql", json={"query": query})
+    assert response.status_code == 200
+    messages = [r.getMessage() for r in caplog.records]
+    assert "Suspected N+1 pattern: 2 queries of shape 'SELECT" in messages[-1]
+    assert messages[-1].endswith(" at first, second")
+
+
+def test_normalize_sql():
+    assert (
+        normalize_sql("SELECT *\n  FROM t WHERE (id IN (%s, %s, %s))")
+        == "SELECT * FROM t WHERE (id IN (%s))"
+    )
+
+
+def test_database_connection_pool(mysql_testing_database_read_only):
+    database = create_db_interface(
+        **mysql_testing_database_read_only.connect_params,
+        database=mysql_testing_database_read_only.database,
+        pool_max_connections=1,
+        pool_timeout=5,
+    )
+    database.connect()
+    connection = database.connection()
+    assert database.pool_statistics() == {"in_use": 1, "idle": 0, "max": 1, "waits": 0}
+
+    # Another thread has to wait for the connection to be returned to the pool
+    def execute_query():
+        with database.connection_context():
+            database.execute_sql("SELECT 1")
+
+    thread = threading.Thread(target=execute_query)
+    thread.start()
+    while database.pool_statistics()["waits"] == 0:
+        time.sleep(0.01)
+    database.close()
+    thread.join()
+    assert database.pool_statistics() == {"in_use": 0, "idle": 1, "max": 1, "waits": 1}
+
+    # Connections closed e.g. by the server are discarded on check-out
+    connection.close()
+    database.connect()
+    assert database.connection() is not connection
+    assert database.pool_statistics() == {"in_use": 1, "idle": 0, "max": 1, "waits": 1}
+    database.close_all()
+
+    lines = (
+        MetricsRegistry()
+        .render(pool_statistics={"in_use": 1, "idle": 2, "max": 3, "waits": 4})
+        .splitlines()
+    )
+    assert 'db_pool_connections{state="in_use"} 1' in lines
+    assert 'db_pool_connections{state="idle"} 2' in lines
+    assert "db_pool_max_connections 3" in lines
+    assert "db_pool_waits_total 4" in lines
+
+
+def test_read_replica_routing(client, mysql_testing_database, mocker):
+    # Stand-in replica: another interface to the same database
+    replica = type(mysql_testing_database)(
+        mysql_testing_database.database, **mysql_testing_database.connect_params
+    )
+    mocker.patch.object(db, "replicas", [replica])
+    mocker.patch("boxtribute_server.db.recent_writers", Cache(ttl=60))
+    primary_queries = mocker.spy(mysql_testing_database, "execute_sql")
+    replica_queries = mocker.spy(replica, "execute_sql")
+
+    query = "query { beneficiary(id: 1) { id base { name } } }"
+    assert_successful_request(client, query)
+    assert primary_queries.call_count == 0
+    assert replica_queries.call_count > 0
+    assert replica.is_closed()
+
+    # Mutations, and reads within the same request, are executed by the primary
+    replica_queries.reset_mock()
+    mutation = "mutation { createQrCode { id code } }"
+    assert_successful_request(client, mutation)
+    assert primary_queries.call_count > 0
+    assert replica_queries.call_count == 0
+
+    # The user reads their own writes
+    primary_queries.reset_mock()
+    assert_successful_request(client, query)
+    assert primary_queries.call_count > 0
+    assert replica_queries.call_count == 0
+
+
+def test_replica_connection_parameters(mocker):
+    # Don't re-configure the database of the app used by other tests
+    mocker.patch("boxtribute_server.app.db")
+    app = create_app()
+    configure_app(
+        app,
+        host="primary",
+        database="dropapp",
+        user="user",
+        unix_socket="/cloudsql/primary",
+        replica_hosts=["replica"],
+    )
+    (replica,) = app.config["DATABASE_REPLICAS"]
+    # The socket of the primary database would take precedence over the host
+    assert replica.database == "dropapp"
+    assert replica.connect_params["host"] == "replica"
+    assert "unix_socket" not in replica.connect_params
+    assert app.config["DATABASE"].connect_params["unix_socket"] == "/cloudsql/primary"
+
+
+def test_read_your_writes_across_processes(client, mysql_testing_database, mocker):
+    replica = type(mysql_testing_database)(
+        mysql_testing_database.database, **mysql_testing_database.connect_params
+    )
+    mocker.patch.object(db, "replicas", [replica])
+    mocker.patch("boxtribute_server.db.recent_writers", Cache(ttl=60))
+    mocker.patch.dict(client.application.config, {"SECRET_KEY": "secret"})
+    primary_queries = mocker.spy(mysql_testing_database, "execute_sql")
+    replica_queries = mocker.spy(replica, "execute_sql")
+
+    def post(query, token=None):
+        headers = {} if token is None else {READ_YOUR_WRITES_HEADER: token}
+        primary_queries.reset_mock()
+        replica_queries.reset_mock()
+        response = client.post("/graphql", json={"query": query}, headers=headers)
+        assert response.status_code == 200
+        return response
+
+    # Mutation responses hold a write token; query responses don't
+    mutation = "mutation { createQrCode { id } }"
+    token = post(mutation).headers[READ_YOUR_WRITES_HEADER]
+    query = "query { beneficiary(id: 1) { id } }"
+    assert READ_YOUR_WRITES_HEADER not in post(query, token).headers
+
+    # Another process (without record of the mutation) routes requests holding the
+    # token to the primary database
+    mocker.patch("boxtribute_server.db.recent_writers", Cache(ttl=60))
+    post(query, token)
+    assert primary_queries.call_count > 0
+    assert replica_queries.call_count == 0
+
+    for invalid_token in [None, "invalid", token + "x"]:
+        post(query, invalid_token)
+        assert primary_queries.call_count == 0
+        assert replica_queries.call_count > 0
+
+    # Tokens of expired windows are rejected
+    mocker.patch("boxtribute_server.db.READ_YOUR_WRITES_WINDOW", -1)
+    post(query, token)
+    assert primary_queries.call_count == 0
+    assert replica_queries.call_count > 0
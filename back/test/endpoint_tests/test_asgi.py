@@ -0,0 +1,146 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from boxtribute_server.db import db
+from boxtribute_server.graph_ql.asgi import create_asgi_app
+from boxtribute_server.graph_ql.schema import full_api_schema
+from boxtribute_server.instrumentation import MetricsRegistry
+
+
+def _post(app, path, data):
+    """Send a POST request with JSON data to the ASGI app. Return status code and
+    decoded JSON response.
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "server": ("testserver", 80),
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"authorization", b"Bearer Some.Token"),
+        ],
+    }
+    body = json.dumps(data).encode()
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    status = messages[0]["status"]
+    response = b"".join(m.get("body", b"") for m in messages[1:])
+    return status, json.loads(response)
+
+
+@pytest.fixture
+def asgi_app(read_only_client):
+    executor = ThreadPoolExecutor(max_workers=4)
+    yield create_asgi_app(
+        read_only_client.application, expose_full_graphql=True, executor=executor
+    )
+    executor.shutdown()
+
+
+def test_asgi_app(read_only_client, asgi_app):
+    # Responses are identical to the ones of the WSGI app
+    for query, status_code in [
+        ("query { beneficiaries { elements { id tokens base { id } } } }", 200),
+        ("query { foo }", 400),
+    ]:
+        status, response = _post(asgi_app, "/graphql", {"query": query})
+        assert status == status_code
+        assert response == read_only_client.post("/graphql", json={"query": query}).json
+
+
+@pytest.fixture
+def concurrent_sibling_resolvers(mocker):
+    """Patch the resolvers of the `base` and `organisation` fields such that both have
+    to run at the same time to pass a barrier.
+    """
+    barrier = threading.Barrier(2, timeout=5)
+    for name in ["base", "organisation"]:
+        field = full_api_schema.query_type.fields[name]
+
+        def resolve(*args, _resolve=field.resolve, **kwargs):
+            barrier.wait()
+            return _resolve(*args, **kwargs)
+
+        mocker.patch.object(field, "resolve", resolve)
+
+
+def test_asgi_app_resolves_sibling_fields_concurrently(
+    asgi_app, concurrent_sibling_resolvers
+):
+    query = "query { base(id: 1) { id } organisation(id: 1) { id } }"
+    status, response = _post(asgi_app, "/graphql", {"query": query})
+    assert status == 200
+    assert response["data"] == {"base": {"id": "1"}, "organisation": {"id": "1"}}
+
+
+def test_asgi_app_tracing(asgi_app, concurrent_sibling_resolvers, mocker):
+    mocker.patch("boxtribute_server.routes.GRAPHQL_TRACING", True)
+    registry = MetricsRegistry()
+    mocker.patch("boxtribute_server.instrumentation.metrics_registry", registry)
+
+    query = "query { base(id: 1) { id } organisation(id: 1) { id } }"
+    status, response = _post(asgi_app, "/graphql", {"query": query})
+    assert status == 200
+    resolvers = response["extensions"]["tracing"]["execution"]["resolvers"]
+    # The SQL queries of concurrently resolved fields are attributed to the respective
+    # field
+    assert {r["fieldName"]: r["sqlQueries"] for r in resolvers} == {
+        "base": 1,
+        "organisation": 1,
+    }
+    assert registry.field_sql_queries == {"Query.base": 1, "Query.organisation": 1}
+
+
+def test_asgi_app_resolver_connections(read_only_client, mocker):
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="resolver")
+    app = create_asgi_app(
+        read_only_client.application, expose_full_graphql=True, executor=executor
+    )
+    database = read_only_client.application.config["DATABASE"]
+    # Other fixtures might have re-configured the database wrapper
+    mocker.patch.object(db, "database", database)
+    connecting_threads = []
+
+    def connect(*args, _connect=database._connect, **kwargs):
+        connecting_threads.append(threading.current_thread().name)
+        return _connect(*args, **kwargs)
+
+    mocker.patch.object(database, "_connect", connect)
+
+    query = "query { bases { id } organisation(id: 1) { id } }"
+    for _ in range(2):
+        status, response = _post(app, "/graphql", {"query": query})
+        assert status == 200
+        assert len(response["data"]["bases"]) > 0
+    # The connection of the resolver thread is re-used by all resolvers, and the
+    # select-query of the bases is not evaluated in the event loop's thread
+    assert len(connecting_threads) == 1
+    assert connecting_threads[0].startswith("resolver")
+
+    # Idle connections are re-opened, here by both resolvers
+    mocker.patch(
+        "boxtribute_server.graph_ql.execution.RESOLVER_CONNECTION_IDLE_TIMEOUT", -1
+    )
+    status, _ = _post(app, "/graphql", {"query": query})
+    assert status == 200
+    assert len(connecting_threads) == 3
+
+    executor.submit(db.close_db, None).result()
+    executor.shutdown()
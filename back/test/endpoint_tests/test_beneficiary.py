@@ -1,7 +1,12 @@
 from datetime import date
 
 import pytest
-from boxtribute_server.enums import HumanGender
+from boxtribute_server.cache import Cache
+from boxtribute_server.enums import HumanGender, Language
+from boxtribute_server.graph_ql.pagination import _estimate_count
+from boxtribute_server.models.definitions.beneficiary import Beneficiary
+from boxtribute_server.models.definitions.transaction import Transaction
+from flask import g
 from utils import assert_successful_request
 
 
@@ -44,9 +49,16 @@ def test_beneficiary_query(
     relative_beneficiary,
     default_transaction,
     relative_transaction,
+    beneficiary_languages,
 ):
     query = _generate_beneficiary_query(default_beneficiary["id"])
     beneficiary = assert_successful_request(read_only_client, query)
+    languages = beneficiary.pop("languages")
+    assert sorted(languages) == sorted(
+        Language(lg["language"]).name
+        for lg in beneficiary_languages
+        if lg["beneficiary"] == default_beneficiary["id"]
+    )
     assert beneficiary == {
         "firstName": default_beneficiary["first_name"],
         "lastName": default_beneficiary["last_name"],
@@ -55,7 +67,6 @@ def test_beneficiary_query(
         "base": {"id": str(default_beneficiary["base"])},
         "groupIdentifier": default_beneficiary["group_identifier"],
         "gender": HumanGender(default_beneficiary["gender"]).name,
-        "languages": [],
         "familyHead": None,
         "isVolunteer": False,
         "signed": False,
@@ -291,6 +302,13 @@ def _format(parameter):
         [[{"pattern": '"Z"'}], 0],
         [[{"pattern": '"1234"'}], 2],
         [[{"pattern": '"123"'}], 0],
+        [[{"pattern": '"every bod"'}], 1],
+        [[{"pattern": '"Body comm"'}], 1],
+        [[{"pattern": '"ody"'}], 0],
+        [[{"pattern": '"od"'}], 0],
+        [[{"pattern": '"bo"'}], 2],
+        [[{"pattern": '"every b"'}], 1],
+        [[{"pattern": '"fo fun"'}], 1],
         [[{"createdFrom": '"2022-01-01"'}, {"active": "true"}], 1],
         [[{"active": "true"}, {"registered": "false"}], 0],
         [[{"active": "false"}, {"pattern": '"no"'}], 1],
@@ -315,3 +333,165 @@ def test_beneficiaries_filtered_query(read_only_client, filters, number):
             if name in f:
                 value = f[name] == "true"
                 assert [b[name] for b in beneficiaries] == number * [value]
+
+
+def test_beneficiaries_query_identity_map(read_only_client):
+    query = "query { beneficiaries { elements { base { id } } } }"
+    beneficiaries = assert_successful_request(read_only_client, query)["elements"]
+    assert len({b["base"]["id"] for b in beneficiaries}) == 1
+
+    # The base of all beneficiaries is loaded once, and then taken from the identity map
+    assert g.identity_map.misses == 1
+    assert g.identity_map.hits == len(beneficiaries) - 1
+
+
+def test_beneficiaries_tokens_and_languages_query(
+    read_only_client,
+    mocker,
+    default_transaction,
+    relative_transaction,
+    beneficiary_languages,
+    max_queries,
+):
+    execute_sql = mocker.spy(Transaction._meta.database, "execute_sql")
+    query = "query { beneficiaries { elements { id tokens languages } } }"
+    with max_queries(3):
+        beneficiaries = assert_successful_request(read_only_client, query)["elements"]
+    tokens = {int(b["id"]): b["tokens"] for b in beneficiaries}
+    assert tokens == {
+        1: default_transaction["tokens"] + relative_transaction["tokens"],
+        2: 0,
+        3: default_transaction["tokens"],
+    }
+    languages = {int(b["id"]): sorted(b["languages"]) for b in beneficiaries}
+    assert languages == {
+        1: sorted([Language.en.name, Language.ar.name]),
+        2: [Language.nl.name],
+        3: [],
+    }
+
+    # The balances and languages of all beneficiaries are fetched in a single query
+    # each
+    sql_statements = [c.args[0].upper() for c in execute_sql.call_args_list]
+    assert len([s for s in sql_statements if "SUM" in s]) == 1
+    assert len([s for s in sql_statements if "X_PEOPLE_LANGUAGES" in s]) == 1
+
+
+def test_beneficiaries_total_count_query(read_only_client, mocker):
+    execute_sql = mocker.spy(Transaction._meta.database, "execute_sql")
+
+    def count_queries():
+        return [c for c in execute_sql.call_args_list if "COUNT" in c.args[0].upper()]
+
+    # The total count is only computed if requested
+    query = "query { beneficiaries { elements { id } } }"
+    assert_successful_request(read_only_client, query)
+    assert len(count_queries()) == 0
+
+    mocker.patch("boxtribute_server.graph_ql.pagination.TOTAL_COUNT_CACHE_TTL", 60)
+    mocker.patch("boxtribute_server.graph_ql.pagination.total_count_cache", Cache())
+    query = "query { beneficiaries { totalCount } }"
+    for _ in range(2):
+        assert assert_successful_request(read_only_client, query)["totalCount"] == 3
+    assert len(count_queries()) == 1
+
+
+def test_beneficiaries_estimated_total_count_query(read_only_client, mocker):
+    execute_sql = mocker.spy(Transaction._meta.database, "execute_sql")
+    mocker.patch("boxtribute_server.graph_ql.pagination.TOTAL_COUNT_ESTIMATED", True)
+    now = [0]
+    cache = Cache(clock=lambda: now[0])
+    mocker.patch("boxtribute_server.graph_ql.pagination.TOTAL_COUNT_CACHE_TTL", 60)
+    mocker.patch("boxtribute_server.graph_ql.pagination.total_count_cache", cache)
+
+    def explain_queries():
+        return [
+            c for c in execute_sql.call_args_list if c.args[0].startswith("EXPLAIN")
+        ]
+
+    # The estimate is derived from the execution plan instead of counting the rows
+    query = "query { beneficiaries { totalCount } }"
+    total_count = assert_successful_request(read_only_client, query)["totalCount"]
+    assert isinstance(total_count, int)
+    assert len(explain_queries()) == 1
+    assert not any("COUNT" in c.args[0].upper() for c in execute_sql.call_args_list)
+
+    # Within the TTL, the estimate is taken from the cache
+    now[0] = 59
+    assert assert_successful_request(read_only_client, query)["totalCount"] == (
+        total_count
+    )
+    assert len(explain_queries()) == 1
+    assert cache.hits == 1
+
+    # After expiry, the count is estimated again
+    now[0] = 60
+    assert_successful_request(read_only_client, query)
+    assert len(explain_queries()) == 2
+
+
+def test_estimate_count(mocker):
+    # Plan rows of joined tables: 10 rows of which 50% match, times 4 rows
+    cursor = mocker.Mock(
+        description=[("id",), ("rows",), ("filtered",)],
+        fetchall=lambda: [(1, 10, 50.0), (2, 4, None)],
+    )
+    database = Beneficiary._meta.database
+    execute_sql = mocker.patch.object(database, "execute_sql", return_value=cursor)
+    assert _estimate_count(Beneficiary.select()) == 20
+    assert execute_sql.call_args.args[0].startswith("EXPLAIN SELECT")
+
+
+@pytest.mark.parametrize(
+    "input",
+    [
+        "",
+        """(paginationInput: {after: "MDAwMDAwMDE=", first: 1})""",
+        """(paginationInput: {before: "MDAwMDAwMDM=", last: 1})""",
+    ],
+)
+def test_beneficiaries_paginated_query_count(read_only_client, mocker, input):
+    # Page elements and page info are fetched in a single query
+    execute_sql = mocker.spy(Transaction._meta.database, "execute_sql")
+    query = f"""query {{ beneficiaries{input} {{
+        elements {{ id }}
+        pageInfo {{ hasNextPage hasPreviousPage startCursor endCursor }}
+    }} }}"""
+    assert_successful_request(read_only_client, query)
+    assert execute_sql.call_count == 1
+
+
+@pytest.mark.parametrize(
+    "order_by,ids",
+    [
+        ["{field: lastName}", ["1", "2", "3"]],
+        ["{field: lastName, direction: Descending}", ["3", "2", "1"]],
+        ["{field: firstName}", ["1", "2", "3"]],
+        ["{field: firstName, direction: Descending}", ["3", "2", "1"]],
+        ["{field: groupIdentifier, direction: Descending}", ["3", "2", "1"]],
+        ["{field: createdOn, direction: Descending}", ["3", "2", "1"]],
+    ],
+)
+def test_beneficiaries_ordered_paginated_query(read_only_client, order_by, ids):
+    def fetch_page(pagination_input):
+        query = f"""query {{ beneficiaries(
+                orderBy: {order_by}, paginationInput: {pagination_input}) {{
+            elements {{ id }}
+            pageInfo {{ hasNextPage hasPreviousPage startCursor endCursor }}
+        }} }}"""
+        return assert_successful_request(read_only_client, query)
+
+    # Paginate forwards through all elements, one by one
+    page = fetch_page("{first: 1}")
+    fetched_ids = [e["id"] for e in page["elements"]]
+    while page["pageInfo"]["hasNextPage"]:
+        page = fetch_page(f"""{{first: 1, after: "{page['pageInfo']['endCursor']}"}}""")
+        assert page["pageInfo"]["hasPreviousPage"]
+        fetched_ids.extend(e["id"] for e in page["elements"])
+    assert fetched_ids == ids
+
+    # Paginate backwards, starting from the last element
+    page = fetch_page(f"""{{last: 2, before: "{page['pageInfo']['startCursor']}"}}""")
+    assert [e["id"] for e in page["elements"]] == ids[:2]
+    assert page["pageInfo"]["hasNextPage"]
+    assert not page["pageInfo"]["hasPreviousPage"]
@@ -1,6 +1,6 @@
 import pytest
 from boxtribute_server.enums import BoxState
-from utils import assert_successful_request
+from utils import assert_bad_user_input, assert_successful_request
 
 
 def test_box_query_by_label_identifier(
@@ -109,6 +109,99 @@ def test_box_mutations(client, qr_code_without_box, default_size, another_size):
     assert updated_box["size"] == str(another_size["id"])
 
 
+def test_create_boxes_mutation(
+    client,
+    max_queries,
+    qr_code_without_box,
+    default_size,
+    null_box_state_location,
+    non_default_box_state_location,
+):
+    creation_inputs = [
+        f"""{{ productId: 1, items: {i}, locationId: {location["id"]},
+            sizeId: {default_size["id"]}, comment: "bulk" }}"""
+        for i, location in enumerate(
+            [null_box_state_location, non_default_box_state_location] * 10
+        )
+    ]
+    creation_inputs[0] = creation_inputs[0].replace(
+        "}", f'qrCode: "{qr_code_without_box["code"]}" }}'
+    )
+    mutation = f"""mutation {{
+            createBoxes(creationInputs: [{", ".join(creation_inputs)}]) {{
+                labelIdentifier
+                items
+                state
+                comment
+                qrCode {{ id }}
+            }}
+        }}"""
+    # Validation of locations and QR codes, identifier check, insertion (incl. BEGIN),
+    # selection of boxes, and of their QR codes
+    with max_queries(7):
+        created_boxes = assert_successful_request(client, mutation)
+    assert [b["items"] for b in created_boxes] == list(range(20))
+    assert [b["state"] for b in created_boxes] == ["InStock", "Donated"] * 10
+    assert {b["comment"] for b in created_boxes} == {"bulk"}
+    assert created_boxes[0]["qrCode"] == {"id": str(qr_code_without_box["id"])}
+    assert created_boxes[1]["qrCode"] is None
+    assert len({b["labelIdentifier"] for b in created_boxes}) == 20
+
+    mutation = f"""mutation {{
+            createBoxes(creationInputs: [{creation_inputs[1]},
+                {{ productId: 1, items: 1, locationId: 0, sizeId: 1, comment: "" }}]) {{
+                id
+            }}
+        }}"""
+    response = client.post("/graphql", json={"query": mutation})
+    assert response.json["data"]["createBoxes"] is None
+    assert response.json["errors"][0]["extensions"]["code"] == "BAD_USER_INPUT"
+
+    mutation = f"""mutation {{
+            createBoxes(creationInputs: [{", ".join(creation_inputs * 26)}]) {{
+                id
+            }}
+        }}"""
+    # The inputs are rejected before any database query
+    with max_queries(0):
+        assert_bad_user_input(client, mutation)
+
+
+def test_update_boxes_mutation(
+    client,
+    max_queries,
+    default_boxes,
+    another_size,
+    non_default_box_state_location,
+):
+    label_identifiers = [b["label_identifier"] for b in default_boxes]
+    identifiers_string = ", ".join(f'"{i}"' for i in label_identifiers + ["zzz"])
+    mutation = f"""mutation {{
+            updateBoxes(updateInput: {{
+                labelIdentifiers: [{identifiers_string}],
+                locationId: {non_default_box_state_location["id"]},
+                sizeId: {another_size["id"]},
+            }}) {{
+                updatedBoxes {{ labelIdentifier size state location {{ id }} }}
+                invalidBoxLabelIdentifiers
+            }}
+        }}"""
+    # Location look-up, update (incl. BEGIN), selection of boxes, and of their
+    # locations
+    with max_queries(5):
+        result = assert_successful_request(client, mutation)
+    assert result["invalidBoxLabelIdentifiers"] == ["zzz"]
+    assert result["updatedBoxes"] == [
+        {
+            "labelIdentifier": identifier,
+            "size": str(another_size["id"]),
+            "state": BoxState.Donated.name,
+            "location": {"id": str(non_default_box_state_location["id"])},
+        }
+        for identifier in label_identifiers
+    ]
+
+
 def _format(parameter):
     try:
         return ",".join(f"{k}={v}" for f in parameter for k, v in f.items())
@@ -1,5 +1,6 @@
 from boxtribute_server.enums import BoxState
-from utils import assert_successful_request
+from boxtribute_server.models.definitions.box import Box
+from utils import assert_bad_user_input, assert_successful_request
 
 
 def test_location_query(read_only_client, default_boxes, default_location):
@@ -38,3 +39,45 @@ def test_locations_query(read_only_client, default_location):
             }"""
     queried_location = assert_successful_request(read_only_client, query)[0]
     assert queried_location["name"] == default_location["name"]
+
+
+def test_location_boxes_query_count(read_only_client, mocker, default_location):
+    # Resolving the related resources of the boxes on a page must not cost additional
+    # queries per box
+    execute_sql = mocker.spy(Box._meta.database, "execute_sql")
+    query_counts = []
+    for size in [1, 5]:
+        query = f"""query {{ location(id: "{default_location['id']}") {{
+                    boxes(paginationInput: {{ first: {size} }}) {{
+                        elements {{
+                            product {{ id }}
+                            location {{ id }}
+                            qrCode {{ id }}
+                        }}
+                    }} }} }}"""
+        execute_sql.reset_mock()
+        boxes = assert_successful_request(read_only_client, query)["boxes"]
+        assert len(boxes["elements"]) == size
+        query_counts.append(execute_sql.call_count)
+    assert query_counts[0] == query_counts[1]
+
+
+def test_location_boxes_ordered_query(read_only_client, default_location):
+    query = f"""query {{ location(id: "{default_location['id']}") {{
+                boxes(orderBy: {{field: lastModifiedOn, direction: Descending}}) {{
+                    elements {{ id lastModifiedOn }}
+                }} }} }}"""
+    boxes = assert_successful_request(read_only_client, query)["boxes"]["elements"]
+    assert len(boxes) > 1
+    assert boxes == sorted(
+        boxes, key=lambda b: (b["lastModifiedOn"], int(b["id"])), reverse=True
+    )
+
+
+def test_location_boxes_query_with_invalid_cursor(read_only_client, default_location):
+    query = f"""query {{ location(id: "{default_location['id']}") {{
+                boxes(orderBy: {{field: labelIdentifier}},
+                    paginationInput: {{after: "MDAwMDAwMDE="}}) {{
+                    elements {{ id }}
+                }} }} }}"""
+    assert_bad_user_input(read_only_client, query, value={"boxes": None})
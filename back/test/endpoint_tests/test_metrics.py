@@ -1,5 +1,17 @@
+from datetime import date
+
 import pytest
 from auth import create_jwt_payload
+from boxtribute_server.db import db
+from boxtribute_server.models.definitions.daily_sales import DailySales
+from boxtribute_server.models.definitions.daily_served_beneficiary import (
+    DailyServedBeneficiary,
+)
+from boxtribute_server.models.definitions.metrics_rollup_watermark import (
+    MetricsRollupWatermark,
+)
+from boxtribute_server.models.definitions.transaction import Transaction
+from boxtribute_server.models.metrics import refresh_metrics_rollups
 from utils import assert_successful_request
 
 
@@ -137,3 +149,60 @@ def test_metrics_query_for_god_user(
         "numberOfFamiliesServed": number_of_families_served,
         "numberOfSales": number_of_sales,
     }
+
+
+def test_metrics_query_transaction_metrics_in_single_query(read_only_client, mocker):
+    execute_sql = mocker.spy(Transaction._meta.database, "execute_sql")
+    query = """query { metrics {
+        numberOfFamiliesServed(after: "2020-01-01")
+        ...Sales
+        numberOfSales2022: numberOfSales(after: "2022-01-01")
+        ... on Metrics { numberOfBeneficiariesServed(after: "2020-01-01") }
+        } }
+        fragment Sales on Metrics { numberOfSales(after: "2020-01-01") }"""
+    response = assert_successful_request(read_only_client, query, field="metrics")
+    assert response == {
+        "numberOfFamiliesServed": 2,
+        "numberOfBeneficiariesServed": 3,
+        "numberOfSales": 6,
+        "numberOfSales2022": 0,
+    }
+
+    # One query per date range, apart from looking up the rollup watermark
+    sql_statements = [
+        c.args[0]
+        for c in execute_sql.call_args_list
+        if MetricsRollupWatermark._meta.table_name not in c.args[0]
+    ]
+    assert len(sql_statements) == 2
+
+
+def _refresh_metrics_rollups(**kwargs):
+    """Refresh rollups outside of a request, and return the number of rows in the
+    rollup tables.
+    """
+    with db.database.connection_context():
+        refresh_metrics_rollups(**kwargs)
+        return DailySales.select().count(), DailyServedBeneficiary.select().count()
+
+
+def test_metrics_query_with_rollups(client):
+    query = """query { metrics {
+        numberOfFamiliesServed(after: "2020-01-01")
+        numberOfBeneficiariesServed
+        numberOfSales(before: "2022-01-01")
+        } }"""
+    expected = assert_successful_request(client, query, field="metrics")
+
+    # Transactions up to 2021 are aggregated, the ones from 2021 on are not
+    assert _refresh_metrics_rollups(until=date(2021, 1, 1)) == (1, 2)
+    response = assert_successful_request(client, query, field="metrics")
+    assert response == expected
+
+    assert _refresh_metrics_rollups() == (2, 3)
+    response = assert_successful_request(client, query, field="metrics")
+    assert response == expected
+
+    assert _refresh_metrics_rollups(full=True) == (2, 3)
+    response = assert_successful_request(client, query, field="metrics")
+    assert response == expected
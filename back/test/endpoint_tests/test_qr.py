@@ -1,3 +1,5 @@
+import hashlib
+
 from utils import assert_bad_user_input, assert_successful_request
 
 
@@ -16,6 +18,31 @@ def test_qr_exists_query(read_only_client, default_qr_code):
     assert not qr_exists
 
 
+def test_qr_code_lookup_is_cached(
+    read_only_client, default_box, default_qr_code, max_queries
+):
+    code = default_qr_code["code"]
+    query = f"""query {{ qrExists(qrCode: "{code}") }}"""
+    assert_successful_request(read_only_client, query)
+
+    # Subsequent look-ups of the code are served from the cache
+    with max_queries(0):
+        assert assert_successful_request(read_only_client, query)
+    query = f"""query {{ qrCode(qrCode: "{code}") {{ id box {{ id }} }} }}"""
+    with max_queries(1):
+        queried_code = assert_successful_request(read_only_client, query)
+    assert queried_code == {
+        "id": str(default_qr_code["id"]),
+        "box": {"id": str(default_box["id"])},
+    }
+
+    # Absent codes are not cached
+    query = """query { qrExists(qrCode: "111") }"""
+    for _ in range(2):
+        with max_queries(1):
+            assert not assert_successful_request(read_only_client, query)
+
+
 def test_qr_code_query(read_only_client, default_box, default_qr_code):
     code = default_qr_code["code"]
     query = f"""query {{
@@ -72,3 +99,22 @@ def test_qr_code_mutation(client, box_without_qr_code):
     assert_bad_user_input(
         client, """mutation { createQrCode(boxLabelIdentifier: "xxx") { id } }"""
     )
+
+
+def test_qr_codes_mutation(client, max_queries):
+    mutation = "mutation { createQrCodes(count: 1200) { id code } }"
+    # Three batched inserts, and one statement each for selecting the IDs, computing the
+    # hashes, and selecting the codes (plus the transaction statement)
+    with max_queries(7):
+        qr_codes = assert_successful_request(client, mutation)
+    assert len(qr_codes) == 1200
+    ids = [int(c["id"]) for c in qr_codes]
+    assert ids == sorted(ids)
+    assert [c["code"] for c in qr_codes] == [
+        hashlib.md5(str(i).encode()).hexdigest() for i in ids
+    ]
+
+    for count in [0, 5001]:
+        assert_bad_user_input(
+            client, f"mutation {{ createQrCodes(count: {count}) {{ id }} }}"
+        )
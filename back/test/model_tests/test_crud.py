@@ -5,6 +5,7 @@ from boxtribute_server.exceptions import BoxCreationFailed
 from boxtribute_server.models.crud import (
     BOX_LABEL_IDENTIFIER_GENERATION_ATTEMPTS,
     create_box,
+    create_boxes,
     create_qr_code,
     update_box,
 )
@@ -66,6 +67,38 @@ def test_box_label_identifier_generation(
     assert new_box.label_identifier == new_identifier
 
 
+def test_bulk_box_label_identifier_generation(
+    mocker, default_box, default_location, default_product, default_user, default_size
+):
+    rng_function = mocker.patch("random.choices")
+    data = {
+        "items": 10,
+        "location_id": default_location["id"],
+        "product_id": default_product["id"],
+        "size_id": default_size["id"],
+    }
+
+    # Only the identifiers colliding with existing ones, or with each other, are
+    # re-generated
+    existing_identifier = default_box["label_identifier"]
+    side_effect = [existing_identifier, "11112222", "11112222", "33334444", "55556666"]
+    rng_function.side_effect = side_effect
+    new_boxes = create_boxes(user_id=default_user["id"], creation_inputs=[data] * 3)
+    assert rng_function.call_count == len(side_effect)
+    assert {b.label_identifier for b in new_boxes} == {
+        "11112222",
+        "33334444",
+        "55556666",
+    }
+
+    # Creation fails if no unique identifier can be generated
+    rng_function.reset_mock(side_effect=True)
+    rng_function.return_value = existing_identifier
+    with pytest.raises(BoxCreationFailed):
+        create_boxes(user_id=default_user["id"], creation_inputs=[data])
+    assert rng_function.call_count == BOX_LABEL_IDENTIFIER_GENERATION_ATTEMPTS
+
+
 def test_boxstate_update(
     default_user,
     default_product,
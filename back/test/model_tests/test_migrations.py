@@ -0,0 +1,46 @@
+import importlib
+
+from boxtribute_server.graph_ql.filtering import derive_beneficiary_filter
+from boxtribute_server.models.definitions.beneficiary import Beneficiary
+from peewee_moves import Migrator
+
+
+def _import_migration(name):
+    return importlib.import_module(f"boxtribute_server.migrations.{name}")
+
+
+def test_keyset_pagination_indexes_migration(setup_db_before_test):
+    database = setup_db_before_test
+    migration = _import_migration("0002_add_keyset_pagination_indexes")
+    migrator = Migrator(database)
+    names = {name for _, name, _ in migration.INDEXES}
+
+    def index_names():
+        return {i.name for t in ["stock", "people"] for i in database.get_indexes(t)}
+
+    # Tables created from the models include the indexes declared in their Meta class
+    assert names <= index_names()
+
+    migration.downgrade(migrator)
+    assert not names & index_names()
+    migration.upgrade(migrator)
+    assert names <= index_names()
+
+
+def test_beneficiary_fulltext_index_migration(setup_db_before_test):
+    database = setup_db_before_test
+    migration = _import_migration("0003_add_beneficiary_fulltext_index")
+    migrator = Migrator(database)
+    migration.downgrade(migrator)
+    migration.upgrade(migrator)
+
+    # Search via the full-text index of the migrated table
+    for pattern, ids in [
+        ("every bod", [1]),
+        ("Body", [1, 2]),
+        ("Body no", [2]),
+        ("ody", []),
+    ]:
+        condition = derive_beneficiary_filter({"pattern": pattern})
+        query = Beneficiary.select(Beneficiary.id).where(condition)
+        assert [b.id for b in query.order_by(Beneficiary.id)] == ids
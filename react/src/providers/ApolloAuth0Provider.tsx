@@ -5,6 +5,7 @@
 import React, { useState, useEffect, ReactNode } from "react";
 import {
   ApolloClient,
+  ApolloLink,
   InMemoryCache,
   HttpLink,
   ApolloProvider,
@@ -13,6 +14,28 @@ import {
 import { setContext } from "@apollo/client/link/context";
 import { useAuth0 } from "@auth0/auth0-react";
 
+// Token issued by the back-end after a mutation. Sending it back routes subsequent
+// queries to the primary database, such that they don't miss the changes
+const WRITE_TOKEN_HEADER = "X-Boxtribute-Write-Token";
+let writeToken: string | null = null;
+
+const writeTokenLink = new ApolloLink((operation, forward) => {
+  if (writeToken) {
+    operation.setContext(({ headers }) => ({
+      headers: { ...headers, [WRITE_TOKEN_HEADER]: writeToken },
+    }));
+  }
+  return forward(operation).map((result) => {
+    const token = operation
+      .getContext()
+      .response?.headers?.get(WRITE_TOKEN_HEADER);
+    if (token) {
+      writeToken = token;
+    }
+    return result;
+  });
+});
+
 function ApolloAuth0Provider({ children }: { children: ReactNode }) {
   const { isAuthenticated, getAccessTokenSilently } = useAuth0();
   const [auth0Token, setAuth0Token] = useState<String>("");
@@ -52,7 +75,7 @@ function ApolloAuth0Provider({ children }: { children: ReactNode }) {
 
   const client = new ApolloClient({
     cache: new InMemoryCache(),
-    link: auth0Link.concat(httpLink),
+    link: ApolloLink.from([auth0Link, writeTokenLink, httpLink]),
     defaultOptions,
   });
 